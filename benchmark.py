@@ -0,0 +1,217 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import matplotlib
+import numpy as np
+
+from saw_coupling_sim import get_parser
+from modules.simulation import Simulation, init_sim, iter_sim, get_saw_rr, get_rr_max
+from modules.animation import init_anim_plot, save_anim
+from modules.maximum_amplitude import iter_max_amps, batch_max_amps, sweep_max_amps
+from modules import jit_simulation
+
+def time_best(func, repeat, setup=None):
+    """Get the shortest time taken by func over several runs, with the result of the last run.
+
+    If given, setup is run untimed before every run and its results passed to func.
+    """
+
+    times = []
+    for _ in range(repeat):
+        inputs = setup() if setup else ()
+        start = time.perf_counter()
+        result = func(*inputs)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def get_sim_args(bench_args, density, rr_length, **kwargs):
+    """Get simulation arguments with defaults for a point of the benchmark matrix."""
+
+    sim_args = get_parser().parse_args(['maximum-amplitudes', '--no-cache'])
+    sim_args.datapoint_density = density
+    sim_args.rr_length = rr_length
+    sim_args.wg_length = bench_args.wg_length
+    sim_args.print_freq = sys.maxsize
+    for key, value in kwargs.items():
+        setattr(sim_args, key, value)
+    return sim_args
+
+def bench_matrix_point(bench_args, density, rr_length):
+    """Time every hot path for one datapoint density and RR length."""
+
+    results = []
+    def record(name, seconds, steps, cells, **extra):
+        results.append({'name': name, 'datapoint_density': density, 'rr_length': rr_length,
+                        'seconds': seconds, 'steps_per_sec': steps / seconds,
+                        'cell_updates_per_sec': cells / seconds, **extra})
+        print(f"{name:>20} d={density:<6} rr={rr_length:<6} {seconds:10.4g} s "
+              f"{steps / seconds:12.4g} steps/s {cells / seconds:12.4g} cells/s")
+
+    # Initialisation
+    sim_args = get_sim_args(bench_args, density, rr_length)
+    seconds, (cfg, saw_wg, saw_rr) = time_best(lambda: init_sim(sim_args, sim_args.wg_length), bench_args.repeat)
+    cells = cfg['num_wg_datapoints'] + cfg['num_rr_datapoints']
+    record('init_sim', seconds, 1, cells)
+
+    # Single iterations of a fresh simulation, once SAW generation has fully ramped up
+    def start_iters():
+        cfg, saw_wg, saw_rr = init_sim(sim_args, sim_args.wg_length)
+        start = int(np.ceil(len(cfg['x_gen']) / cfg['wg_shift']))
+        for i in range(start):
+            saw_wg, saw_rr = iter_sim(sim_args, cfg, saw_wg, saw_rr, i)
+        return cfg, saw_wg, saw_rr, start
+    def run_iters(cfg, saw_wg, saw_rr, start):
+        for i in range(start, start + bench_args.iterations):
+            saw_wg, saw_rr = iter_sim(sim_args, cfg, saw_wg, saw_rr, i)
+    seconds, _ = time_best(run_iters, bench_args.repeat, start_iters)
+    record('iter_sim', seconds / bench_args.iterations, 1, cells)
+
+    # Full convergence of a single coupling length
+    def run_max_amp():
+        return iter_max_amps(sim_args, *init_sim(sim_args, sim_args.wg_length))
+    seconds, (_, num_iters) = time_best(run_max_amp, bench_args.repeat)
+    record('iter_max_amps', seconds, num_iters, num_iters * cells, iterations=int(num_iters))
+
+    # Small coupling length sweeps with every available engine
+    wg_lengths = np.arange(0, bench_args.sweep_max_wg_length, bench_args.sweep_step_wg_length)
+    for engine in get_engines():
+        sweep_args = get_sim_args(bench_args, density, rr_length, engine=engine)
+        sweep_max_amps(sweep_args, wg_lengths[:1])  # Compile kernels before timing
+        seconds, (_, num_iters) = time_best(lambda: sweep_max_amps(sweep_args, wg_lengths), bench_args.repeat)
+        num_cells = np.sum(num_iters * (np.round(wg_lengths * density) + cfg['num_rr_datapoints']))
+        record(f'sweep_max_amps[{engine}]', seconds, num_iters.sum(), num_cells,
+               points=len(wg_lengths), iterations=int(num_iters.sum()))
+
+    # Animation frames, drawn and encoded
+    if shutil.which(matplotlib.rcParams['animation.ffmpeg_path']):
+        anim_args = get_sim_args(bench_args, density, rr_length)
+        cfg, saw_wg, saw_rr = init_sim(anim_args, anim_args.wg_length)
+        canvas, line_input, line_ring, iter_text = init_anim_plot(anim_args)
+        def iter_anim(i):
+            nonlocal saw_wg, saw_rr
+            iter_text.set_text(f'Iteration: {i}')
+            saw_wg, saw_rr = iter_sim(anim_args, cfg, saw_wg, saw_rr, i)
+            line_input.set_data(cfg['x_wg'], saw_wg)
+            line_ring.set_data(cfg['x_rr'], get_saw_rr(cfg, saw_rr))
+            return line_input, line_ring, iter_text
+        with tempfile.TemporaryDirectory() as dirname:
+            seconds, _ = time_best(lambda: save_anim(anim_args, canvas, range(bench_args.frames), iter_anim,
+                                                     os.path.join(dirname, 'bench.mp4')), 1)
+        record('animation_frames', seconds, bench_args.frames, bench_args.frames * cells, frames=bench_args.frames)
+    else:
+        print("WARNING - ffmpeg not found, skipping animation benchmark")
+
+    return results
+
+def get_engines():
+    """Get the maximum amplitude engines that can be run."""
+
+    return ['numpy'] + (['numba'] if jit_simulation.numba is not None else [])
+
+def check_engines(bench_args, density, rr_length):
+    """Check that every batched engine matches the reference iter_sim maximum amplitudes, and Simulation matches exactly."""
+
+    checks = []
+    wg_lengths = np.arange(0, bench_args.sweep_max_wg_length, bench_args.sweep_step_wg_length)
+    ref_args = get_sim_args(bench_args, density, rr_length, conv_tol=0, iterations=bench_args.check_iterations)
+    ref = np.array([iter_max_amps(ref_args, *init_sim(ref_args, wg_length))[0] for wg_length in wg_lengths])
+
+    for engine in get_engines():
+        engine_args = get_sim_args(bench_args, density, rr_length, conv_tol=0, iterations=bench_args.check_iterations,
+                                   engine=engine)
+        max_amps, _ = batch_max_amps(engine_args, wg_lengths)
+        error = float(np.max(np.abs(max_amps - ref)) / np.max(ref))
+        passed = error <= bench_args.tol
+        checks.append({'engine': engine, 'datapoint_density': density, 'rr_length': rr_length,
+                       'relative_error': error, 'passed': bool(passed)})
+        print(f"{'check[' + engine + ']':>20} d={density:<6} rr={rr_length:<6} relative error {error:.3g} "
+              f"{'PASSED' if passed else 'FAILED'}")
+
+    # Simulation must be bitwise identical to iter_sim, with velocities needing fractional shifts when interpolating
+    for propagation, vel in [("integer", 2), ("fractional", 2.1)]:
+        for dtype in ["float64", "float32"]:
+            sim_args = get_sim_args(bench_args, density, rr_length, propagation=propagation, dtype=dtype,
+                                    wg_vel=vel, rr_vel=vel)
+            cfg, saw_wg, saw_rr = init_sim(sim_args, sim_args.wg_length)
+            max_amp = 0
+            for i in range(bench_args.check_iterations):
+                saw_wg, saw_rr = iter_sim(sim_args, cfg, saw_wg, saw_rr, i)
+                max_amp = max(max_amp, get_rr_max(cfg, saw_rr))
+            sim = Simulation.from_args(sim_args)
+            sim_max_amp = sim.run(bench_args.check_iterations)
+            passed = (sim_max_amp == max_amp and np.array_equal(sim.saw_wg, saw_wg)
+                      and np.array_equal(sim.saw_rr, get_saw_rr(cfg, saw_rr)))
+            name = f"Simulation[{propagation},{dtype}]"
+            checks.append({'engine': name, 'datapoint_density': density, 'rr_length': rr_length,
+                           'relative_error': float(abs(sim_max_amp - max_amp) / max_amp), 'passed': bool(passed)})
+            print(f"{'check[' + name + ']':>20} d={density:<6} rr={rr_length:<6} "
+                  f"{'PASSED' if passed else 'FAILED'} (bitwise)")
+
+    return checks
+
+def compare_results(results, prev_results):
+    """Print the speed-up of every benchmark relative to a previous run."""
+
+    prev = {(r['name'], r['datapoint_density'], r['rr_length']): r for r in prev_results}
+    for r in results:
+        key = (r['name'], r['datapoint_density'], r['rr_length'])
+        if key in prev:
+            speedup = prev[key]['seconds'] / r['seconds']
+            flag = "  WARNING - slower" if speedup < 0.9 else ""
+            print(f"{r['name']:>20} d={r['datapoint_density']:<6} rr={r['rr_length']:<6} {speedup:6.2f}x{flag}")
+
+def get_commit():
+    """Get the current git commit, if any."""
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the SAW coupling simulation hot paths.")
+    parser.add_argument("--output-dir", type=str, default='outputs/benchmarks/', help="Path to output directory.")
+    parser.add_argument("--compare", type=str, help="Path to previous benchmark results to compare against.")
+    parser.add_argument("--densities", type=int, nargs='+', default=[100, 200, 400], help="Datapoint densities to benchmark.")
+    parser.add_argument("--rr-lengths", type=float, nargs='+', default=[15, 30], help="Ring resonator lengths to benchmark.")
+    parser.add_argument("--wg-length", type=float, default=2, help="Waveguide length for single simulations.")
+    parser.add_argument("--iterations", type=int, default=1000, help="Number of iterations to time iter_sim over.")
+    parser.add_argument("--frames", type=int, default=100, help="Number of animation frames to time.")
+    parser.add_argument("--sweep-max-wg-length", type=float, default=5, help="Maximum waveguide length of benchmark sweeps.")
+    parser.add_argument("--sweep-step-wg-length", type=float, default=0.25, help="Waveguide length step of benchmark sweeps.")
+    parser.add_argument("--check-iterations", type=int, default=500, help="Number of iterations to check engines over.")
+    parser.add_argument("--tol", type=float, default=1e-9, help="Relative tolerance of engines against reference.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs to take the fastest of.")
+    args = parser.parse_args()
+
+    # Time every hot path and check engines across the matrix of densities and RR lengths
+    results, checks = [], []
+    for density in args.densities:
+        for rr_length in args.rr_lengths:
+            results += bench_matrix_point(args, density, rr_length)
+            checks += check_engines(args, density, rr_length)
+
+    # Save results with machine details so runs can be compared
+    timestamp = datetime.datetime.now().strftime("%m%d-%H%M%S")
+    os.makedirs(args.output_dir, exist_ok=True)
+    filename = f"{args.output_dir}benchmark-{timestamp}.json"
+    with open(filename, 'w') as f:
+        json.dump({'commit': get_commit(), 'python': platform.python_version(), 'numpy': np.__version__,
+                   'numba': getattr(jit_simulation.numba, '__version__', None), 'machine': platform.platform(),
+                   'cpus': os.cpu_count(), 'settings': vars(args), 'results': results, 'checks': checks}, f, indent=4)
+    print(f"Saved: {filename}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(results, json.load(f)['results'])
+
+    if not all(check['passed'] for check in checks):
+        sys.exit("Engine check failed!")
@@ -0,0 +1,144 @@
+import datetime
+import numpy as np
+
+from .maximum_amplitude import sweep_max_amps, check_engine
+from .plotting import get_pyplot
+
+def get_refine_intervals(num_datapoints, max_amps, min_width, grad_tol, min_prominence):
+    """Get the sample intervals to split, next to prominent local maxima or where the amplitude changes steeply.
+
+    Intervals are given by the index of their first sample and are only
+    split while wider than min_width datapoints.
+    """
+
+    wide = np.diff(num_datapoints) > min_width
+    steep = np.abs(np.diff(max_amps)) > grad_tol * np.max(max_amps)
+
+    # Intervals either side of every prominent local maximum
+    peaks = get_peak_idxs(max_amps, min_prominence)
+    near_peak = np.zeros(len(wide), dtype=bool)
+    near_peak[peaks[peaks > 0] - 1] = True
+    near_peak[peaks[peaks < len(wide)]] = True
+
+    return np.flatnonzero(wide & (steep | near_peak))
+
+def get_peak_idxs(max_amps, min_prominence=0):
+    """Get the indices of the local maxima of the samples, including at either end.
+
+    Only maxima standing at least min_prominence (relative to the highest
+    sample) above the lowest sample between them and any higher sample on
+    each side are kept, so ripple is not mistaken for peaks.
+    """
+
+    padded = np.concatenate(([-np.inf], max_amps, [-np.inf]))
+    peaks = np.flatnonzero((padded[1:-1] >= padded[:-2]) & (padded[1:-1] > padded[2:]))
+
+    prominent = []
+    for k in peaks:
+        # Lowest sample on each side before reaching a higher sample, or the end
+        higher = np.flatnonzero(max_amps > max_amps[k])
+        left, right = higher[higher < k], higher[higher > k]
+        left_base = max_amps[(left[-1] if len(left) else 0):k+1].min()
+        right_base = max_amps[k:(right[0] + 1 if len(right) else len(max_amps))].min()
+        if max_amps[k] - max(left_base, right_base) >= min_prominence * np.max(max_amps):
+            prominent.append(k)
+    return np.array(prominent, dtype=int)
+
+def locate_peaks(wg_lengths, max_amps, min_prominence=0):
+    """Locate the prominent local maxima of the samples, refined with a parabola through each peak and its neighbours."""
+
+    peaks = []
+    for k in get_peak_idxs(max_amps, min_prominence):
+        if 0 < k < len(max_amps) - 1:
+            a, b, c = np.polyfit(wg_lengths[k-1:k+2] - wg_lengths[k], max_amps[k-1:k+2], 2)
+            offset = -b / (2 * a) if a < 0 else 0
+            peaks.append((wg_lengths[k] + offset, c - b**2 / (4 * a) if a < 0 else max_amps[k]))
+        else:
+            peaks.append((wg_lengths[k], max_amps[k]))
+
+    return np.array(peaks).reshape(-1, 2)
+
+def adaptive_max_amps(args, wg_lengths):
+    """Sweep the coupling length, refining around peaks and steep changes until the tolerance is met.
+
+    Starts from the given coupling lengths and returns the non-uniform
+    coupling lengths sampled with their maximum amplitudes and iterations.
+    """
+
+    # Samples are identified by their number of datapoints so refined points are always simulable
+    min_width = max(1, round(args.refine_tol * args.datapoint_density))
+    new_num_datapoints = np.unique(np.round(wg_lengths * args.datapoint_density).astype(int))
+    samples = {}
+
+    while len(new_num_datapoints) > 0:
+        print(f"Refining: {len(new_num_datapoints)} new coupling lengths")
+        max_amps, num_iters = sweep_max_amps(args, new_num_datapoints / args.datapoint_density)
+        samples.update(zip(new_num_datapoints, zip(max_amps, num_iters)))
+
+        # Split intervals in half, rounded to the datapoint grid
+        num_datapoints = np.array(sorted(samples))
+        intervals = get_refine_intervals(num_datapoints, np.array([samples[n][0] for n in num_datapoints]),
+                                         min_width, args.refine_grad, args.refine_prominence)
+        new_num_datapoints = (num_datapoints[intervals] + num_datapoints[intervals + 1]) // 2
+
+    num_datapoints = np.array(sorted(samples))
+    return (num_datapoints / args.datapoint_density, np.array([samples[n][0] for n in num_datapoints]),
+            np.array([samples[n][1] for n in num_datapoints]))
+
+def run_adaptive_sweep(args):
+    """Run the adaptive sweep mode."""
+
+    # Check that all input waveguide lengths can actually be simulated
+    if np.floor(np.log10(abs(1/args.coarse_step_wg_length))) > np.floor(np.log10(abs(args.datapoint_density))):
+        raise ValueError("Datapoint density too small for specified waveguide length step size!")
+    if args.refine_tol * args.datapoint_density < 1:
+        print(f"WARNING - Refinement tolerance smaller than datapoint spacing, refining to {1 / args.datapoint_density}")
+
+    check_engine(args)
+
+    # Coarse coupling lengths to refine
+    wg_lengths = np.arange(args.min_wg_length, args.max_wg_length, args.coarse_step_wg_length)
+
+    if args.dry_run:
+        return
+
+    # Simulate coarse coupling lengths then refine
+    wg_lengths, max_amps, num_iters = adaptive_max_amps(args, wg_lengths)
+    peaks = locate_peaks(wg_lengths, max_amps, args.refine_prominence)
+
+    # Report number of samples and located peaks
+    print(f"Coupling lengths simulated: {len(wg_lengths)}")
+    print(f"Iterations used: {num_iters.min()}-{num_iters.max()} (total {num_iters.sum()})")
+    max_amp_norm_factor = 1 / np.max(np.concatenate((max_amps, peaks[:, 1])))  # Fitted peaks can exceed the samples
+    print("Peaks:")
+    for wg_length, max_amp in peaks:
+        print(f"    Coupling length: {wg_length:.4f}, maximum amplitude: {max_amp:.6g} "
+              f"(normalised: {max_amp * max_amp_norm_factor:.4f})")
+
+    # Save samples and peaks with timestamp
+    timestamp = datetime.datetime.now().strftime("%m%d-%H%M%S")
+    filename = f"{args.output_dir}adaptive-sweep-{timestamp}"
+    np.savetxt(f"{filename}.csv", np.column_stack((wg_lengths, max_amps, num_iters)), delimiter=',',
+               header="wg_length,max_amp,iterations", comments='', fmt=['%.10g', '%.10g', '%d'])
+    np.savetxt(f"{filename}-peaks.csv", peaks, delimiter=',', header="wg_length,max_amp", comments='', fmt='%.10g')
+    print(f"Saved: {filename}.csv")
+    print(f"Saved: {filename}-peaks.csv")
+
+    if args.no_plot:
+        return
+
+    # Generate plot showing every sample
+    plt = get_pyplot()
+    plt.plot(wg_lengths, max_amps * max_amp_norm_factor, '.-', ms=3)
+    plt.plot(peaks[:, 0], peaks[:, 1] * max_amp_norm_factor, 'x', label='Peaks')
+    plt.xlim(wg_lengths[0], wg_lengths[-1])
+    plt.ylim(0, 1.05)
+    plt.title("Variation in Maximum RR SAW Amplitude\nWith Coupling Length Between Input and RR")
+    plt.xlabel("Coupling Length (Number of SAW Wavelengths)")
+    plt.ylabel("Normalised Maximum SAW Amplitude")
+    plt.legend(loc="upper right")
+    plt.tight_layout()
+
+    # Save plot
+    plt.savefig(f"{filename}.png", format='png', dpi=300)
+    print(f"Saved: {filename}.png")
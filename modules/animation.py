@@ -1,25 +1,26 @@
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
 import datetime
+import subprocess
 
-from .simulation import init_sim, iter_sim
+from .simulation import init_sim, iter_sim, get_saw_rr
+from .profiling import profiled, stage
 
-def run_anim(args):
-    """Run the animation mode."""
+def init_anim_plot(args):
+    """Initialise the animation plot, drawn off-screen so frames can be sent straight to the encoder."""
 
-    # Initialise simulation
-    cfg, saw_wg, saw_rr = init_sim(args, args.wg_length)
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
 
-    # Initialise plot
-    fig, ax = plt.subplots()
+    fig = Figure()
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.subplots()
     ax.set_xlim(0, args.rr_length)
     ax.set_ylim(-2, 2)
-    line_input, = ax.plot([], [], lw=3, label='Input')
-    line_ring, = ax.plot([], [], lw=3, label='Ring')
+    line_input, = ax.plot([], [], lw=3, label='Input', animated=True)
+    line_ring, = ax.plot([], [], lw=3, label='Ring', animated=True)
     ax.set_title("Simulation of SAW Coupling")
     ax.set_xlabel("Waveguide Position (SAW Wavelengths)")
     ax.set_ylabel("Amplitude (arb.)")
-    iter_text = ax.text(0.02, 0.98, '', ha='left', va='top', transform=ax.transAxes)
+    iter_text = ax.text(0.02, 0.98, '', ha='left', va='top', transform=ax.transAxes, animated=True)
     cfg_text = (f"SAW velocity in input: {args.wg_vel} (arb.)\n"
                 f"SAW velocity in RR: {args.rr_vel} (arb.)\n"
                 f"Input to RR coupling coefficient: {args.wg2rr_coupl}\n"
@@ -31,11 +32,50 @@ def run_anim(args):
     ax.text(0.98, 0, cfg_text, ha='right', va='bottom', transform=ax.transAxes)
     ax.legend(loc="upper right")
 
-    # Initialise animation
-    def init_anim():
-        line_input.set_data([], [])
-        line_ring.set_data([], [])
-        return line_input, line_ring
+    return canvas, line_input, line_ring, iter_text
+
+@profiled
+def save_anim(args, canvas, frames, set_frame, filename):
+    """Save an animation by drawing only the changing artists of each frame and streaming it to ffmpeg."""
+
+    # Draw static parts of the plot once
+    fig = canvas.figure
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+    width, height = canvas.get_width_height()
+
+    # Stream raw frames to ffmpeg
+    import matplotlib
+    encoder = subprocess.Popen([matplotlib.rcParams['animation.ffmpeg_path'],
+                                '-f', 'rawvideo', '-vcodec', 'rawvideo', '-s', f'{width}x{height}',
+                                '-pix_fmt', 'rgba', '-framerate', str(args.fps), '-loglevel', 'error',
+                                '-i', 'pipe:', '-vcodec', 'h264', '-pix_fmt', 'yuv420p',
+                                '-vf', 'crop=trunc(iw/2)*2:trunc(ih/2)*2', '-y', filename],
+                               stdin=subprocess.PIPE)
+    try:
+        for frame in frames:
+            with stage('set_frame'):
+                artists = set_frame(frame)
+            with stage('draw'):
+                canvas.restore_region(background)
+                for artist in artists:
+                    artist.axes.draw_artist(artist)
+            with stage('encode'):
+                encoder.stdin.write(canvas.buffer_rgba())
+    finally:
+        encoder.stdin.close()
+    if encoder.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed to encode animation (exit code {encoder.returncode})")
+    print(f"Saved: {filename}")
+
+def run_anim(args):
+    """Run the animation mode."""
+
+    # Initialise simulation
+    cfg, saw_wg, saw_rr = init_sim(args, args.wg_length)
+
+    # Initialise plot
+    canvas, line_input, line_ring, iter_text = init_anim_plot(args)
 
     # Iterate animation
     def iter_anim(i):
@@ -43,13 +83,11 @@ def run_anim(args):
         iter_text.set_text(f'Iteration: {i}')
         saw_wg, saw_rr = iter_sim(args, cfg, saw_wg, saw_rr, i)
         line_input.set_data(cfg['x_wg'], saw_wg)
-        line_ring.set_data(cfg['x_rr'], saw_rr)
-        return line_input, line_ring
+        line_ring.set_data(cfg['x_rr'], get_saw_rr(cfg, saw_rr))
+        return line_input, line_ring, iter_text
 
     # Generate and save animation
     if not args.dry_run:
-        anim = FuncAnimation(fig, iter_anim, init_func=init_anim, frames=args.iterations, interval=cfg['delta_t'] * 1000)
         timestamp = datetime.datetime.now().strftime("%m%d-%H%M%S")
         filename = f"{args.output_dir}animation-{timestamp}.mp4"
-        anim.save(filename, writer='ffmpeg', fps=args.fps)
-        print(f"Saved: {filename}")
+        save_anim(args, canvas, range(args.iterations), iter_anim, filename)
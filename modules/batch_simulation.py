@@ -0,0 +1,250 @@
+import os
+import time
+import numpy as np
+
+from . import profiling
+from .profiling import profiled
+from .checkpoint import save_state, load_state
+from .simulation import init_source, get_source, get_roll, shift_saw, get_rr_slices, renorm_rr, get_rr_max, get_conv_period, check_conv
+
+# Coefficients that can vary between rows of a batch sharing the same geometry
+ROW_COEFFS = ['wg2rr_coupl', 'wg2rr_loss', 'rr2wg_coupl', 'rr2wg_loss', 'wg_decay_exp']
+
+# Parameters that can vary between rows, the coefficients and the input SAW frequency
+ROW_PARAMS = ROW_COEFFS + ['frequency']
+
+@profiled
+def init_batch_sim(args, wg_lengths, row_coeffs=None):
+    """Initialise a batch of simulations, one row per input waveguide length.
+
+    row_coeffs optionally maps any of ROW_PARAMS to a value for every row,
+    overriding the value in args.
+    """
+
+    delta_t = 1 / args.fps
+    wg_lengths = np.asarray(wg_lengths, dtype=float)
+    num_rows = len(wg_lengths)
+
+    # Calculate array velocity
+    wg_shift = delta_t * args.datapoint_density * args.wg_vel
+    rr_shift = delta_t * args.datapoint_density * args.rr_vel
+    wg_roll, wg_interp = get_roll(args, wg_shift)
+    rr_roll, rr_interp = get_roll(args, rr_shift)
+
+    wg_total_lengths = wg_lengths + args.wg_edge_length
+
+    # Calculate number of datapoints in different lengths for every row
+    num_wg_mid_datapoints = np.round(wg_lengths * args.datapoint_density).astype(int)
+    num_wg_edge_datapoints = int(round(args.wg_edge_length * args.datapoint_density))
+    half_num_wg_edge_datapoints = num_wg_edge_datapoints // 2
+    num_wg_datapoints = np.round(wg_total_lengths * args.datapoint_density).astype(int)
+    num_gen_datapoints = half_num_wg_edge_datapoints + wg_roll + (0 if wg_interp is None else 2)
+    num_rr_datapoints = int(round(args.rr_length * args.datapoint_density))
+
+    # Rows are padded to the longest input waveguide in the batch
+    num_pad_datapoints = int(num_wg_datapoints.max())
+    if num_pad_datapoints > num_rr_datapoints:
+        raise ValueError("Ring resonator too short for specified waveguide lengths!")
+
+    # Create padded window array, zero beyond the end of each row's waveguide
+    window = np.zeros((num_rows, num_pad_datapoints), dtype=args.dtype)
+    for row in range(num_rows):
+        window[row, :num_wg_datapoints[row]] = np.concatenate((
+            0.5 * (1 + np.sin(np.linspace(-np.pi/2, np.pi/2, half_num_wg_edge_datapoints))),
+            np.ones(num_wg_mid_datapoints[row]),
+            0.5 * (1 - np.sin(np.linspace(-np.pi/2, np.pi/2, half_num_wg_edge_datapoints)))
+        ))
+
+    # Create coupling mask to restrict RR loss to each row's coupling region
+    coupl_mask = (np.arange(num_pad_datapoints) < num_wg_datapoints[:, None]).astype(args.dtype)
+
+    # Create position arrays at full precision, matching np.linspace(..., endpoint=False) on each row
+    x_wg = np.arange(num_pad_datapoints) * (wg_total_lengths / num_wg_datapoints)[:, None]
+    x_gen = x_wg[:, 0:num_gen_datapoints]
+    x_rr = np.linspace(0, args.rr_length, num_rr_datapoints, endpoint=False)
+
+    # Create config dictionary
+    cfg = {'delta_t': delta_t,
+           'num_rows': num_rows,
+           'num_wg_datapoints': num_wg_datapoints,
+           'num_pad_datapoints': num_pad_datapoints,
+           'half_num_wg_edge_datapoints': half_num_wg_edge_datapoints,
+           'num_rr_datapoints': num_rr_datapoints,
+           'wg_roll': wg_roll,
+           'rr_roll': rr_roll,
+           'wg_shift': wg_roll if wg_interp is None else wg_shift,
+           'wg_interp': wg_interp,
+           'rr_interp': rr_interp,
+           'window': window,
+           'coupl_mask': coupl_mask,
+           'x_wg': x_wg,
+           'x_gen': x_gen,
+           'x_rr': x_rr,
+           'rr_head': 0,
+           'rr_scale': 1.0,
+           'scratch': np.empty((num_rows, num_pad_datapoints), dtype=args.dtype)}
+
+    # Coefficients varying between rows are stored as columns to broadcast along each row
+    row_coeffs = row_coeffs or {}
+    for key in ROW_PARAMS:
+        cfg[key] = np.asarray(row_coeffs[key], dtype=float)[:, None] if key in row_coeffs else getattr(args, key)
+        if key in ROW_COEFFS and key in row_coeffs:
+            cfg[key] = cfg[key].astype(args.dtype)
+    cfg['source'] = init_source(x_gen, delta_t * args.wg_vel, cfg['frequency'], args.dtype)
+
+    # Initialise SAWs
+    saw_wg = np.zeros((num_rows, num_pad_datapoints), dtype=args.dtype)
+    saw_rr = np.zeros((num_rows, num_rr_datapoints), dtype=args.dtype)
+
+    return cfg, saw_wg, saw_rr
+
+def iter_batch_sim(args, cfg, saw_wg, saw_rr, i):
+    """Perform a single iteration of every simulation in the batch."""
+
+    # Time each stage only when profiling
+    laps = profiling.start_laps('iter_batch_sim') if profiling.state['enabled'] else None
+
+    num_pad = cfg['num_pad_datapoints']
+    scratch = cfg['scratch']
+
+    # Gradually introduce SAW into input waveguide at same rate as SAW velocity
+    num_gen = min(int(np.ceil(i * cfg['wg_shift'])), cfg['x_gen'].shape[1])
+    saw_wg[:, :num_gen] = get_source(cfg['source'], i)[:, :num_gen]  # SAW generation
+    if laps:
+        profiling.lap(laps, 'generation')
+
+    # Apply window array
+    saw_wg *= cfg['window']
+    if laps:
+        profiling.lap(laps, 'window')
+
+    # RR is stored as a ring buffer; find the buffer slices holding the coupling region
+    rr_slices = get_rr_slices(cfg, 0, num_pad)
+    rr_scale = cfg['rr_scale']
+
+    # WG to RR SAW coupling and loss
+    np.multiply(cfg['wg2rr_coupl'] / rr_scale, saw_wg, out=scratch)
+    for rr_slice, wg_slice in rr_slices:
+        saw_rr[:, rr_slice] += scratch[:, wg_slice]  # Coupling
+    if not args.no_loss:
+        np.multiply(cfg['wg2rr_loss'], saw_wg, out=scratch)
+        saw_wg -= scratch  # Loss
+    if laps:
+        profiling.lap(laps, 'wg2rr_coupling')
+
+    # RR to WG SAW coupling and loss
+    if not args.no_rr2wg:
+        for rr_slice, wg_slice in rr_slices:
+            np.multiply(cfg['rr2wg_coupl'] * rr_scale, saw_rr[:, rr_slice], out=scratch[:, wg_slice])
+        saw_wg += scratch  # Coupling
+        if not args.no_loss:
+            for rr_slice, wg_slice in rr_slices:
+                np.multiply(cfg['rr2wg_loss'], saw_rr[:, rr_slice], out=scratch[:, wg_slice])
+            scratch *= cfg['coupl_mask']
+            for rr_slice, wg_slice in rr_slices:
+                saw_rr[:, rr_slice] -= scratch[:, wg_slice]  # Loss
+    if laps:
+        profiling.lap(laps, 'rr2wg_coupling')
+
+    # Travelling SAW (RR moves its head instead of copying its data)
+    saw_wg = shift_saw(saw_wg, cfg['wg_roll'], cfg['wg_interp'])
+    cfg['rr_head'] = (cfg['rr_head'] - cfg['rr_roll']) % cfg['num_rr_datapoints']
+    if cfg['rr_interp'] is not None:
+        saw_rr = shift_saw(saw_rr, 0, cfg['rr_interp'])
+    if laps:
+        profiling.lap(laps, 'travel')
+
+    # SAW decay (RR decay is accumulated into a global scale factor)
+    saw_wg *= (1 - 0.1 ** cfg['wg_decay_exp'])
+    cfg['rr_scale'] *= (1 - 0.1 ** args.rr_decay_exp)
+    renorm_rr(cfg, saw_rr)
+    if laps:
+        profiling.lap(laps, 'decay')
+
+    return saw_wg, saw_rr
+
+def select_batch_rows(cfg, saw_wg, saw_rr, rows):
+    """Keep only the selected rows of a batch of simulations."""
+
+    cfg = dict(cfg)
+    for key in ['num_wg_datapoints', 'window', 'coupl_mask', 'x_wg', 'x_gen', 'scratch']:
+        cfg[key] = cfg[key][rows]
+    for key in ROW_PARAMS:
+        if isinstance(cfg[key], np.ndarray):
+            cfg[key] = cfg[key][rows]
+    cfg['source'] = dict(cfg['source'], x_gen=cfg['x_gen'], frequency=cfg['frequency'],
+                         table=cfg['source']['table'][:, rows])
+    cfg['num_rows'] = len(cfg['num_wg_datapoints'])
+
+    return cfg, saw_wg[rows], saw_rr[rows]
+
+@profiled
+def iter_batch_max_amps(args, cfg, saw_wg, saw_rr, state_path=None):
+    """Iterate the maximum RR amplitude mode for every simulation in the batch.
+
+    Each row iterates until its maximum amplitude converges (or for
+    args.iterations if args.conv_tol is 0). Converged rows are dropped from
+    the batch. Returns the maximum amplitudes and numbers of iterations used.
+
+    If state_path is given, the in-flight state is saved there every
+    args.checkpoint_interval seconds, and resumed from if args.resume.
+    """
+
+    max_iters = args.max_iterations if args.conv_tol else args.iterations
+    conv_period = get_conv_period(cfg)
+
+    max_amps = np.zeros(cfg['num_rows'])
+    num_iters = np.full(cfg['num_rows'], max_iters)
+
+    # Track running values of the rows still being simulated
+    rows = np.arange(cfg['num_rows'])
+    row_max_amps = np.zeros(cfg['num_rows'])
+    prev_max_amps, prev_rises, num_conv = np.zeros(len(rows)), np.zeros(len(rows)), np.zeros(len(rows), dtype=int)
+    i_start = 0
+
+    # Continue from the saved state of an interrupted batch
+    state = load_state(state_path) if state_path and args.resume else None
+    if state is not None:
+        i_start = int(state['i'])
+        max_amps, num_iters, rows = state['max_amps'], state['num_iters'], state['rows']
+        row_max_amps, prev_max_amps, prev_rises, num_conv = (
+            state['row_max_amps'], state['prev_max_amps'], state['prev_rises'], state['num_conv'])
+        cfg, _, _ = select_batch_rows(cfg, saw_wg, saw_rr, rows)
+        saw_wg, saw_rr = state['saw_wg'], state['saw_rr']
+        cfg['rr_head'], cfg['rr_scale'] = int(state['rr_head']), float(state['rr_scale'])
+    last_save = time.perf_counter()
+
+    for i in range(i_start, max_iters):
+        # Iterate the simulations and set maximum SAW value of each row
+        saw_wg, saw_rr = iter_batch_sim(args, cfg, saw_wg, saw_rr, i)
+        np.maximum(row_max_amps, get_rr_max(cfg, saw_rr), out=row_max_amps)
+
+        # Drop rows whose maximum SAW value has converged for two consecutive periods
+        if args.conv_tol and (i + 1) % conv_period == 0:
+            converged, prev_rises = check_conv(args, row_max_amps, prev_max_amps, prev_rises)
+            num_conv = np.where(converged, num_conv + 1, 0)
+            prev_max_amps = row_max_amps.copy()
+            done = num_conv == 2
+            if done.any():
+                max_amps[rows[done]] = row_max_amps[done]
+                num_iters[rows[done]] = i + 1
+                if done.all():
+                    break
+                keep = ~done
+                rows, row_max_amps, prev_max_amps, prev_rises, num_conv = (
+                    rows[keep], row_max_amps[keep], prev_max_amps[keep], prev_rises[keep], num_conv[keep])
+                cfg, saw_wg, saw_rr = select_batch_rows(cfg, saw_wg, saw_rr, keep)
+
+        # Save in-flight state, with rows kept relative to the initial batch
+        if state_path and args.checkpoint_interval and time.perf_counter() - last_save >= args.checkpoint_interval:
+            save_state(state_path, i=i + 1, max_amps=max_amps, num_iters=num_iters, rows=rows,
+                       row_max_amps=row_max_amps, prev_max_amps=prev_max_amps, prev_rises=prev_rises,
+                       num_conv=num_conv, saw_wg=saw_wg, saw_rr=saw_rr, rr_head=cfg['rr_head'],
+                       rr_scale=cfg['rr_scale'])
+            last_save = time.perf_counter()
+    else:
+        max_amps[rows] = row_max_amps
+
+    if state_path and os.path.exists(state_path):
+        os.remove(state_path)
+    return max_amps, num_iters
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+
+def get_cache_params(args):
+    """Get every argument that affects the maximum RR amplitude of a coupling length."""
+
+    params = {key: getattr(args, key) for key in [
+        'fps', 'datapoint_density', 'dtype', 'propagation', 'no_loss', 'no_rr2wg',
+        'frequency', 'wg_edge_length', 'wg_vel', 'wg2rr_coupl', 'wg2rr_loss', 'wg_decay_exp',
+        'rr_length', 'rr_vel', 'rr2wg_coupl', 'rr2wg_loss', 'rr_decay_exp',
+        'conv_tol']}
+
+    # Number of iterations run depends on whether convergence is checked
+    if args.conv_tol:
+        params['max_iterations'] = args.max_iterations
+    else:
+        params['iterations'] = args.iterations
+
+    return params
+
+def get_cache_path(args):
+    """Get the cache file path, addressed by a hash of the simulation parameters."""
+
+    params = json.dumps(get_cache_params(args), sort_keys=True)
+    return os.path.join(args.cache_dir, f"{hashlib.sha256(params.encode()).hexdigest()}.json")
+
+def load_cache(args):
+    """Load cached results as a dictionary of coupling length datapoints to (maximum amplitude, iterations)."""
+
+    path = get_cache_path(args)
+    if not os.path.exists(path):
+        return {}
+
+    # Mark cache file as recently used
+    os.utime(path)
+    with open(path) as f:
+        points = json.load(f)['points']
+    return {int(num_datapoints): tuple(result) for num_datapoints, result in points.items()}
+
+def save_cache(args, results):
+    """Add results to the cache and evict least recently used cache files if it is too large."""
+
+    os.makedirs(args.cache_dir, exist_ok=True)
+    points = load_cache(args)
+    points.update(results)
+
+    # Write to temporary file first so that an interrupted run cannot corrupt the cache
+    path = get_cache_path(args)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump({'params': get_cache_params(args),
+                   'points': {str(num_datapoints): [float(max_amp), int(num_iters)]
+                              for num_datapoints, (max_amp, num_iters) in sorted(points.items())}}, f)
+    os.replace(f"{path}.tmp", path)
+
+    evict_cache(args, keep=path)
+
+def evict_cache(args, keep=None):
+    """Delete least recently used cache files until the cache fits within its maximum size."""
+
+    paths = [os.path.join(args.cache_dir, name) for name in os.listdir(args.cache_dir) if name.endswith('.json')]
+    paths.sort(key=os.path.getmtime)
+    total_size = sum(os.path.getsize(path) for path in paths)
+
+    for path in paths:
+        if total_size <= args.cache_size * 1e6:
+            break
+        if path != keep:
+            total_size -= os.path.getsize(path)
+            os.remove(path)
@@ -0,0 +1,79 @@
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+
+from .cache import get_cache_params
+
+def get_hash(data):
+    """Get a short hash of JSON serialisable data."""
+
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16]
+
+def get_checkpoint_path(args, name, extra=None, ext='json'):
+    """Get a checkpoint file path, addressed by a hash of the simulation parameters and of any extra data."""
+
+    extra_hash = "" if extra is None else f"-{get_hash(extra)}"
+    return os.path.join(args.checkpoint_dir, f"{name}-{get_hash(get_cache_params(args))}{extra_hash}.{ext}")
+
+def load_checkpoint(args):
+    """Load the completed points of an interrupted sweep and the chunks it was split into.
+
+    Points are a dictionary of datapoints to (maximum amplitude, iterations)
+    and chunks a list of lists of datapoints.
+    """
+
+    path = get_checkpoint_path(args, "points")
+    if not os.path.exists(path):
+        return {}, []
+    with open(path) as f:
+        checkpoint = json.load(f)
+    points = {int(num_datapoints): tuple(result) for num_datapoints, result in checkpoint['points'].items()}
+    return points, checkpoint.get('chunks', [])
+
+def save_checkpoint(args, results, chunks=None):
+    """Save the completed points of a sweep, with the chunks of datapoints it is split into."""
+
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+
+    # Write to temporary file first so that an interruption cannot corrupt the checkpoint
+    path = get_checkpoint_path(args, "points")
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump({'params': get_cache_params(args),
+                   'points': {str(num_datapoints): [float(max_amp), int(num_iters)]
+                              for num_datapoints, (max_amp, num_iters) in sorted(results.items())},
+                   'chunks': [[int(num_datapoints) for num_datapoints in chunk] for chunk in chunks or []]}, f)
+    os.replace(f"{path}.tmp", path)
+
+def clear_checkpoint(args):
+    """Delete the completed points and any in-flight states of a finished sweep."""
+
+    path = get_checkpoint_path(args, "points")
+    if os.path.exists(path):
+        os.remove(path)
+    for path in glob.glob(os.path.join(args.checkpoint_dir, f"state-{get_hash(get_cache_params(args))}-*.npz*")):
+        os.remove(path)
+
+def get_state_path(args, wg_lengths, row_coeffs=None):
+    """Get the path of the in-flight state of a batch of simulations."""
+
+    num_datapoints = np.round(np.asarray(wg_lengths) * args.datapoint_density).astype(int).tolist()
+    row_coeffs = {key: np.asarray(values, dtype=float).tolist() for key, values in (row_coeffs or {}).items()}
+    return get_checkpoint_path(args, "state", {'num_datapoints': num_datapoints, 'row_coeffs': row_coeffs}, 'npz')
+
+def save_state(path, **state):
+    """Save the in-flight state of a batch of simulations."""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", 'wb') as f:
+        np.savez(f, **state)
+    os.replace(f"{path}.tmp", path)
+
+def load_state(path):
+    """Load the in-flight state of a batch of simulations, or None if there is none."""
+
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as state:
+        return dict(state)
@@ -0,0 +1,65 @@
+import datetime
+import numpy as np
+
+from .grid_sweep import grid_max_amps
+from .maximum_amplitude import check_engine
+from .spectrum import get_resonances
+from .plotting import get_pyplot
+
+def run_frequency_sweep(args):
+    """Run the frequency sweep mode."""
+
+    check_engine(args)
+
+    # Every frequency shares the same geometry, so they are simulated as rows of the same batches
+    frequencies = np.arange(args.min_frequency, args.max_frequency, args.step_frequency)
+    if len(frequencies) == 0 or frequencies[0] <= 0:
+        raise ValueError("Frequencies must be positive and include at least one step!")
+    print(f"Frequencies: {len(frequencies)}")
+
+    if args.dry_run:
+        return
+
+    # Simulate all frequencies at the single coupling length
+    max_amps, num_iters = grid_max_amps(args, [args.wg_length], [('frequency', frequencies)])
+    max_amps, num_iters = max_amps[0], num_iters[0]
+    resonances = get_resonances(frequencies, max_amps)
+
+    # Report number of iterations used and resonances
+    print(f"Iterations used: {num_iters.min()}-{num_iters.max()} (total {num_iters.sum()})")
+    if args.conv_tol and np.any(num_iters == args.max_iterations):
+        print(f"WARNING - {np.sum(num_iters == args.max_iterations)} frequencies did not converge "
+              f"within {args.max_iterations} iterations")
+    print("Resonances:")
+    for freq, amp, fwhm, q_factor in resonances:
+        print(f"    Frequency: {freq:.5f}, maximum amplitude: {amp:.6g}, FWHM: {fwhm:.4g}, Q factor: {q_factor:.1f}")
+
+    # Save samples and resonances with timestamp
+    timestamp = datetime.datetime.now().strftime("%m%d-%H%M%S")
+    filename = f"{args.output_dir}frequency-sweep-{timestamp}"
+    np.savetxt(f"{filename}.csv", np.column_stack((frequencies, max_amps, num_iters)), delimiter=',',
+               header="frequency,max_amp,iterations", comments='', fmt=['%.10g', '%.10g', '%d'])
+    np.savetxt(f"{filename}-resonances.csv", resonances, delimiter=',', header="frequency,max_amp,fwhm,q_factor",
+               comments='', fmt='%.10g')
+    print(f"Saved: {filename}.csv")
+    print(f"Saved: {filename}-resonances.csv")
+
+    if args.no_plot:
+        return
+
+    # Generate plot of the comb of RR resonances
+    plt = get_pyplot()
+    max_amp_norm_factor = 1 / np.max(max_amps)
+    plt.plot(frequencies, max_amps * max_amp_norm_factor, lw=1)
+    plt.plot(resonances[:, 0], resonances[:, 1] * max_amp_norm_factor, 'x', label='Resonances')
+    plt.xlim(frequencies[0], frequencies[-1])
+    plt.ylim(0, 1.05)
+    plt.title("Variation in Maximum RR SAW Amplitude\nWith Input SAW Frequency")
+    plt.xlabel("Frequency (Relative to Drive Frequency)")
+    plt.ylabel("Normalised Maximum SAW Amplitude")
+    plt.legend(loc="upper right")
+    plt.tight_layout()
+
+    # Save plot
+    plt.savefig(f"{filename}.png", format='png', dpi=300)
+    print(f"Saved: {filename}.png")
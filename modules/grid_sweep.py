@@ -0,0 +1,150 @@
+import argparse
+import contextlib
+import datetime
+import functools
+import itertools
+import multiprocessing
+import numpy as np
+
+from .batch_simulation import ROW_PARAMS
+from .maximum_amplitude import batch_max_amps, check_engine
+from .cache import load_cache, save_cache
+from .telemetry import run_chunk, start_progress, update_progress
+from .plotting import get_pyplot
+
+# Parameters that can be swept; the rest change the shape or RR decay of a batch so cannot vary between its rows
+GRID_PARAMS = ROW_PARAMS + ['wg_vel', 'rr_vel', 'rr_length', 'rr_decay_exp']
+
+def parse_grid_axis(spec):
+    """Parse a grid axis given as NAME=MIN:MAX:STEP or NAME=VALUE,VALUE,..."""
+
+    name, sep, values = spec.partition('=')
+    name = name.strip().replace('-', '_')
+    if not sep or name not in GRID_PARAMS:
+        raise ValueError(f"Grid axis must be NAME=MIN:MAX:STEP or NAME=VALUE,... with NAME one of {', '.join(GRID_PARAMS)}!")
+
+    if ':' in values:
+        start, stop, step = (float(value) for value in values.split(':'))
+        return name, np.arange(start, stop, step)
+    return name, np.array([float(value) for value in values.split(',')])
+
+def batch_chunk(chunk):
+    """Get the maximum RR amplitudes of a chunk given as (args, coupling lengths, per-row coefficients)."""
+
+    return batch_max_amps(*chunk)
+
+def grid_max_amps(args, wg_lengths, axes):
+    """Get the maximum RR amplitude and number of iterations used at every point of a parameter grid.
+
+    axes is a list of (name, values) pairs. Returns arrays with the coupling
+    length as the first dimension, followed by one dimension per axis.
+    """
+
+    # Collapse coupling lengths with the same number of datapoints into a single simulation
+    num_datapoints = np.round(np.asarray(wg_lengths) * args.datapoint_density).astype(int)
+    unique_num_datapoints, unique_idxs = np.unique(num_datapoints, return_inverse=True)
+
+    names = [name for name, _ in axes]
+    combos = list(itertools.product(*(values for _, values in axes)))
+    combo_args = [argparse.Namespace(**{**vars(args), **dict(zip(names, combo))}) for combo in combos]
+
+    # Only simulate points that are not cached
+    results = [{} if args.no_cache else load_cache(point_args) for point_args in combo_args]
+    num_cached = sum(np.isin(unique_num_datapoints, list(combo_results)).sum() for combo_results in results)
+    if num_cached:
+        print(f"Cached: {num_cached}/{len(unique_num_datapoints) * len(combos)} grid points")
+
+    # Points sharing a geometry are simulated together, varying only coefficients and frequency between rows
+    groups = {}
+    for k, point_args in enumerate(combo_args):
+        geometry = tuple(getattr(point_args, name) for name in GRID_PARAMS if name not in ROW_PARAMS)
+        for n in unique_num_datapoints:
+            if n not in results[k]:
+                groups.setdefault(geometry, []).append((k, n))
+
+    # Split each group into chunks, making sure every worker has a chunk
+    num_sim = sum(len(points) for points in groups.values())
+    chunk_size = min(args.chunk_size, -(-num_sim // args.workers)) if num_sim else 1
+    chunks, chunk_points = [], []
+    for points in groups.values():
+        for start in range(0, len(points), chunk_size):
+            points_chunk = points[start:start+chunk_size]
+            combo_idxs, sim_num_datapoints = np.array(points_chunk).T
+            row_coeffs = {name: [getattr(combo_args[k], name) for k in combo_idxs] for name in names if name in ROW_PARAMS}
+            chunks.append((combo_args[combo_idxs[0]], sim_num_datapoints / args.datapoint_density, row_coeffs))
+            chunk_points.append(points_chunk)
+
+    sim_results = [{} for _ in combos]
+    progress = start_progress(args, num_sim, "grid points")
+    with multiprocessing.Pool(args.workers) if args.workers > 1 else contextlib.nullcontext() as pool:
+        map_chunks = pool.imap if args.workers > 1 else map
+        results_chunks = map_chunks(functools.partial(run_chunk, batch_chunk), chunks)
+        for points_chunk, ((chunk_max_amps, chunk_num_iters), peak_memory) in zip(chunk_points, results_chunks):
+            # Update progress after each complete chunk
+            update_progress(args, progress, len(points_chunk), np.sum(chunk_num_iters),
+                            peak_memory if args.workers > 1 else None)
+            for (k, n), max_amp, num_iters in zip(points_chunk, chunk_max_amps, chunk_num_iters):
+                sim_results[k][n] = (max_amp, num_iters)
+
+    for k, point_args in enumerate(combo_args):
+        if sim_results[k] and not args.no_cache:
+            save_cache(point_args, sim_results[k])
+        results[k].update(sim_results[k])
+
+    # Expand results back to every coupling length
+    shape = (len(wg_lengths),) + tuple(len(values) for _, values in axes)
+    max_amps = np.array([[results[k][n][0] for k in range(len(combos))] for n in unique_num_datapoints])
+    num_iters = np.array([[results[k][n][1] for k in range(len(combos))] for n in unique_num_datapoints])
+    return max_amps[unique_idxs].reshape(shape), num_iters[unique_idxs].reshape(shape)
+
+def run_grid_sweep(args):
+    """Run the grid sweep mode."""
+
+    # Check that all input waveguide lengths can actually be simulated
+    if np.floor(np.log10(abs(1/args.step_wg_length))) > np.floor(np.log10(abs(args.datapoint_density))):
+        raise ValueError("Datapoint density too small for specified waveguide length step size!")
+
+    check_engine(args)
+
+    # Generate grid axes, with coupling length always first
+    wg_lengths = np.arange(args.min_wg_length, args.max_wg_length, args.step_wg_length)
+    axes = [parse_grid_axis(spec) for spec in args.grid or []]
+    names = ['wg_length'] + [name for name, _ in axes]
+    if len(set(names)) < len(names):
+        raise ValueError("Grid axes must all be different parameters!")
+    print(f"Grid: {' x '.join(f'{name} ({len(values)})' for name, values in [('wg_length', wg_lengths)] + axes)}")
+
+    if args.dry_run:
+        return
+
+    # Simulate all grid points
+    max_amps, num_iters = grid_max_amps(args, wg_lengths, axes)
+
+    # Report number of iterations used and best grid point
+    print(f"Iterations used: {num_iters.min()}-{num_iters.max()} (total {num_iters.sum()})")
+    if args.conv_tol and np.any(num_iters == args.max_iterations):
+        print(f"WARNING - {np.sum(num_iters == args.max_iterations)} grid points did not converge "
+              f"within {args.max_iterations} iterations")
+    best = np.unravel_index(np.argmax(max_amps), max_amps.shape)
+    values = [wg_lengths] + [values for _, values in axes]
+    print("Maximum RR amplitude: " + f"{max_amps[best]:.6g} at "
+          + ', '.join(f"{name}={axis_values[idx]:.6g}" for name, axis_values, idx in zip(names, values, best)))
+
+    # Save labelled results with timestamp
+    timestamp = datetime.datetime.now().strftime("%m%d-%H%M%S")
+    filename = f"{args.output_dir}grid-sweep-{timestamp}"
+    np.savez(f"{filename}.npz", axes=np.array(names), max_amps=max_amps, num_iters=num_iters,
+             **dict(zip(names, values)))
+    print(f"Saved: {filename}.npz")
+
+    # Plot heat map of normalised maximum amplitudes for two-dimensional grids
+    if len(names) == 2 and not args.no_plot:
+        plt = get_pyplot()
+        plt.pcolormesh(values[0], values[1], (max_amps / np.max(max_amps)).T, shading='nearest', vmin=0, vmax=1)
+        plt.colorbar(label="Normalised Maximum SAW Amplitude")
+        plt.title("Variation in Maximum RR SAW Amplitude")
+        plt.xlabel("Coupling Length (Number of SAW Wavelengths)")
+        plt.ylabel(names[1])
+        plt.tight_layout()
+        plt.savefig(f"{filename}.png", format='png', dpi=300)
+        print(f"Saved: {filename}.png")
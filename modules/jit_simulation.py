@@ -0,0 +1,138 @@
+import numpy as np
+
+from .profiling import profiled, stage
+from .simulation import get_source_block, get_conv_period, check_conv, MIN_RR_SCALE
+from .batch_simulation import init_batch_sim, ROW_COEFFS
+
+# Numba is optional; without it the NumPy engine is used instead
+try:
+    import numba
+except ImportError:
+    numba = None
+
+def jit(func):
+    """Compile a kernel with Numba, caching the compiled code on disk."""
+
+    if numba is None:
+        return func
+    return numba.njit(cache=True, parallel=True)(func)
+
+prange = numba.prange if numba is not None else range
+
+@jit
+def iter_rows(saw_wg, saw_rr, window, source, source_start, source_period, num_wg, num_gen, wg_heads, rr_heads,
+              rr_scales, max_amps, active, i_start, num_iters, wg_roll, rr_roll, wg2rr_coupl, wg2rr_loss, rr2wg_coupl, rr2wg_loss,
+              wg_decay, rr_decay, min_rr_scale, no_loss, no_rr2wg):
+    """Perform several iterations of every active row in a single fused loop.
+
+    Both SAWs are ring buffers: logical position j of a row is stored at
+    (head + j) % length. The RR SAW is scaled by its row's rr_scales entry.
+    Coupling, loss and input waveguide decay coefficients are given per row,
+    and are applied at float64 whatever the precision of the SAWs.
+    The source at iteration i is source[(i - source_start) % source_period].
+    """
+
+    num_rr = saw_rr.shape[1]
+    for row in prange(saw_wg.shape[0]):
+        if not active[row]:
+            continue
+        row_num_wg = num_wg[row]
+        wg_head, rr_head, rr_scale, max_amp = wg_heads[row], rr_heads[row], rr_scales[row], max_amps[row]
+
+        for i in range(i_start, i_start + num_iters):
+            # Gradually introduce SAW into input waveguide at same rate as SAW velocity
+            for j in range(min(i * wg_roll, num_gen[row])):
+                saw_wg[row, (wg_head + j) % row_num_wg] = source[(i - source_start) % source_period, row, j]
+
+            # Window, coupling, loss and decay of each position in the coupling region
+            rr_max = -np.inf
+            wg_idx, rr_idx = wg_head, rr_head
+            for j in range(row_num_wg):
+                wg = saw_wg[row, wg_idx] * window[row, j]
+                rr = saw_rr[row, rr_idx] + (wg2rr_coupl[row] / rr_scale) * wg
+                if not no_loss:
+                    wg -= wg2rr_loss[row] * wg
+                if not no_rr2wg:
+                    wg += (rr2wg_coupl[row] * rr_scale) * rr
+                    if not no_loss:
+                        rr -= rr2wg_loss[row] * rr
+                saw_wg[row, wg_idx] = wg * wg_decay[row]
+                saw_rr[row, rr_idx] = rr
+                rr_max = max(rr_max, rr)
+                wg_idx = wg_idx + 1 if wg_idx + 1 < row_num_wg else 0
+                rr_idx = rr_idx + 1 if rr_idx + 1 < num_rr else 0
+
+            # Travelling SAW and RR decay
+            wg_head = (wg_head - wg_roll) % row_num_wg
+            rr_head = (rr_head - rr_roll) % num_rr
+            rr_scale *= rr_decay
+            max_amp = max(max_amp, rr_scale * rr_max)
+
+            # Fold RR scale factor back into the ring buffer before it underflows
+            if rr_scale < min_rr_scale:
+                for j in range(num_rr):
+                    saw_rr[row, j] *= rr_scale
+                rr_scale = 1.0
+
+        wg_heads[row], rr_heads[row], rr_scales[row], max_amps[row] = wg_head, rr_head, rr_scale, max_amp
+
+def get_row_values(cfg, key):
+    """Get a coefficient of a batch as a float64 array with a value for every row."""
+
+    return np.broadcast_to(cfg[key], (cfg['num_rows'], 1))[:, 0].astype(float)
+
+@profiled
+def jit_batch_max_amps(args, wg_lengths, row_coeffs=None):
+    """Get the maximum RR amplitudes of a chunk of coupling lengths with the Numba engine.
+
+    Matches iter_batch_max_amps, returning the maximum amplitudes and numbers
+    of iterations used.
+    """
+
+    cfg, saw_wg, saw_rr = init_batch_sim(args, wg_lengths, row_coeffs)
+    num_rows = cfg['num_rows']
+    coeffs = {key: get_row_values(cfg, key) for key in ROW_COEFFS}
+    num_gen = np.minimum(cfg['x_gen'].shape[1], cfg['num_wg_datapoints'])
+
+    max_iters = args.max_iterations if args.conv_tol else args.iterations
+    conv_period = get_conv_period(cfg) if args.conv_tol else max_iters
+
+    # Per-row ring buffer state
+    wg_heads = np.zeros(num_rows, dtype=np.int64)
+    rr_heads = np.zeros(num_rows, dtype=np.int64)
+    rr_scales = np.ones(num_rows)
+    max_amps = np.zeros(num_rows)
+    active = np.ones(num_rows, dtype=np.bool_)
+    num_iters = np.full(num_rows, max_iters)
+
+    prev_max_amps, prev_rises, num_conv = np.zeros(num_rows), np.zeros(num_rows), np.zeros(num_rows, dtype=int)
+    for i in range(0, max_iters, conv_period):
+        # Iterate active rows for a period at a time, in blocks of the source if it has no period
+        with stage('iter_rows'):
+            num_period_iters = min(conv_period, max_iters - i)
+            block_steps = num_period_iters if cfg['source']['period'] else cfg['source']['block_steps']
+            for j in range(i, i + num_period_iters, block_steps):
+                num_block_iters = min(block_steps, i + num_period_iters - j)
+                if cfg['source']['period']:
+                    source, source_start, source_period = cfg['source']['table'], 0, cfg['source']['period']
+                else:
+                    source, source_start, source_period = get_source_block(cfg['source'], j, num_block_iters), j, num_block_iters
+                iter_rows(saw_wg, saw_rr, cfg['window'], source, source_start, source_period, cfg['num_wg_datapoints'],
+                          num_gen, wg_heads, rr_heads, rr_scales, max_amps, active, j, num_block_iters,
+                          cfg['wg_roll'], cfg['rr_roll'],
+                          coeffs['wg2rr_coupl'], coeffs['wg2rr_loss'], coeffs['rr2wg_coupl'], coeffs['rr2wg_loss'],
+                          1 - 0.1 ** coeffs['wg_decay_exp'], 1 - 0.1 ** args.rr_decay_exp,
+                          MIN_RR_SCALE[saw_rr.dtype.name], args.no_loss, args.no_rr2wg)
+
+        # Deactivate rows whose maximum SAW value has converged for two consecutive periods
+        if args.conv_tol and i + conv_period <= max_iters:
+            converged, prev_rises = check_conv(args, max_amps, prev_max_amps, prev_rises)
+            num_conv = np.where(converged, num_conv + 1, 0)
+            prev_max_amps = max_amps.copy()
+            done = active & (num_conv == 2)
+            num_iters[done] = i + conv_period
+            active &= ~done
+            if not active.any():
+                break
+
+    return max_amps, num_iters
@@ -1,21 +1,157 @@
+import contextlib
 import datetime
+import functools
+import multiprocessing
+import time
 import numpy as np
-import matplotlib.pyplot as plt
 
-from .simulation import init_sim, iter_sim, print_iter
+from .simulation import iter_sim, get_rr_max, get_conv_period, check_conv
+from .batch_simulation import init_batch_sim, iter_batch_max_amps
+from .cache import load_cache, save_cache
+from .checkpoint import load_checkpoint, save_checkpoint, clear_checkpoint, get_state_path
+from .profiling import profiled, stage
+from .telemetry import run_chunk, start_progress, update_progress
+from .plotting import get_pyplot
 
+@profiled
 def iter_max_amps(args, cfg, saw_wg, saw_rr):
-    """Iterate the maximum RR amplitude mode."""
+    """Iterate the maximum RR amplitude mode.
+
+    Iterates until the maximum amplitude converges (or for args.iterations if
+    args.conv_tol is 0) and returns it with the number of iterations used.
+    """
+
+    max_iters = args.max_iterations if args.conv_tol else args.iterations
+    conv_period = get_conv_period(cfg)
 
     max_amp = 0
-    for i in range(args.iterations):
+    prev_max_amp, prev_rise, num_conv = 0, 0, 0
+    for i in range(max_iters):
         # Iterate the simulation and get maximum SAW amplitude in the iteration
         saw_wg, saw_rr = iter_sim(args, cfg, saw_wg, saw_rr, i)
         # Set maximum SAW value for entire simulation
-        if max(saw_rr) > max_amp:
-            max_amp = max(saw_rr)
+        rr_max = get_rr_max(cfg, saw_rr)
+        if rr_max > max_amp:
+            max_amp = rr_max
+
+        # Stop once maximum SAW value has converged for two consecutive periods
+        if args.conv_tol and (i + 1) % conv_period == 0:
+            converged, prev_rise = check_conv(args, max_amp, prev_max_amp, prev_rise)
+            num_conv = num_conv + 1 if converged else 0
+            prev_max_amp = max_amp
+            if num_conv == 2:
+                return max_amp, i + 1
+
+    return max_amp, max_iters
+
+def batch_max_amps(args, wg_lengths, row_coeffs=None):
+    """Get the maximum RR amplitudes of a chunk of coupling lengths simulated at once."""
+
+    if args.engine == "numba":
+        from . import jit_simulation  # Only import Numba when it is used
+        return jit_simulation.jit_batch_max_amps(args, wg_lengths, row_coeffs)
+
+    cfg, saw_wg, saw_rr = init_batch_sim(args, wg_lengths, row_coeffs)
+    state_path = get_state_path(args, wg_lengths, row_coeffs) if args.checkpoint_state else None
+    return iter_batch_max_amps(args, cfg, saw_wg, saw_rr, state_path)
+
+@profiled
+def sweep_max_amps(args, wg_lengths):
+    """Get the maximum RR amplitude and number of iterations used for every coupling length in a sweep."""
+
+    # Collapse coupling lengths with the same number of datapoints into a single simulation
+    num_datapoints = np.round(np.asarray(wg_lengths) * args.datapoint_density).astype(int)
+    unique_num_datapoints, unique_idxs = np.unique(num_datapoints, return_inverse=True)
+
+    # Only simulate coupling lengths that are not cached
+    results = {} if args.no_cache else load_cache(args)
+    sim_num_datapoints = [n for n in unique_num_datapoints if n not in results]
+    if len(sim_num_datapoints) < len(unique_num_datapoints):
+        print(f"Cached: {len(unique_num_datapoints) - len(sim_num_datapoints)}/{len(unique_num_datapoints)} coupling lengths")
+
+    # Continue from the coupling lengths completed before an interruption
+    checkpoint, checkpoint_chunks = load_checkpoint(args) if args.resume else ({}, [])
+    checkpoint = {n: result for n, result in checkpoint.items() if n in sim_num_datapoints}
+    if checkpoint:
+        print(f"Resumed: {len(checkpoint)}/{len(sim_num_datapoints)} coupling lengths")
+        results.update(checkpoint)
+        sim_num_datapoints = [n for n in sim_num_datapoints if n not in checkpoint]
+
+    if len(sim_num_datapoints) > 0:
+        # Split coupling lengths into chunks, making sure every worker has a chunk
+        chunk_size = min(args.chunk_size, -(-len(sim_num_datapoints) // args.workers))
+        num_datapoints_chunks = get_chunks(sim_num_datapoints, chunk_size, checkpoint_chunks)
+        sim_num_datapoints = [n for chunk in num_datapoints_chunks for n in chunk]  # Results come back in chunk order
+        chunks = [np.array(chunk) / args.datapoint_density for chunk in num_datapoints_chunks]
+
+        max_amps, num_iters = [], []
+        progress = start_progress(args, len(sim_num_datapoints), "coupling lengths")
+        last_save = time.perf_counter()
+        with multiprocessing.Pool(args.workers) if args.workers > 1 else contextlib.nullcontext() as pool:
+            # Workers return only the maximum amplitudes, in the same order as the chunks
+            map_chunks = pool.imap if args.workers > 1 else map
+            run_batch = functools.partial(run_chunk, batch_max_amps, args)
+            try:
+                for (chunk_max_amps, chunk_num_iters), peak_memory in map_chunks(run_batch, chunks):
+                    # Update progress after each complete chunk
+                    update_progress(args, progress, len(chunk_max_amps), np.sum(chunk_num_iters),
+                                    peak_memory if args.workers > 1 else None)
+                    max_amps.extend(chunk_max_amps)
+                    num_iters.extend(chunk_num_iters)
+
+                    # Periodically save completed coupling lengths
+                    if args.checkpoint_interval and time.perf_counter() - last_save >= args.checkpoint_interval:
+                        save_checkpoint(args, {**checkpoint, **dict(zip(sim_num_datapoints, zip(max_amps, num_iters)))},
+                                        num_datapoints_chunks)
+                        last_save = time.perf_counter()
+            except KeyboardInterrupt:
+                if args.checkpoint_interval:
+                    save_checkpoint(args, {**checkpoint, **dict(zip(sim_num_datapoints, zip(max_amps, num_iters)))},
+                                    num_datapoints_chunks)
+                    print("\nInterrupted: saved checkpoint, continue with --resume")
+                raise
+
+        sim_results = dict(zip(sim_num_datapoints, zip(max_amps, num_iters)))
+        results.update(sim_results)
+        if not args.no_cache:
+            save_cache(args, {**checkpoint, **sim_results})
+    elif checkpoint and not args.no_cache:
+        save_cache(args, checkpoint)
+    clear_checkpoint(args)
 
-    return max_amp
+    # Expand results back to every coupling length
+    max_amps = np.array([results[n][0] for n in unique_num_datapoints])[unique_idxs]
+    num_iters = np.array([results[n][1] for n in unique_num_datapoints])[unique_idxs]
+    return max_amps, num_iters
+
+def get_chunks(num_datapoints, chunk_size, prev_chunks=()):
+    """Split datapoints into chunks, keeping the chunks of an interrupted sweep so their in-flight states are resumed."""
+
+    remaining = set(num_datapoints)
+    chunks = []
+    for chunk in prev_chunks:
+        chunk = [n for n in chunk if n in remaining]
+        if chunk:
+            chunks.append(chunk)
+            remaining -= set(chunk)
+
+    # Chunk any datapoints that were not in the interrupted sweep as normal
+    rest = [n for n in num_datapoints if n in remaining]
+    return chunks + [rest[start:start+chunk_size] for start in range(0, len(rest), chunk_size)]
+
+def check_engine(args):
+    """Fall back to the NumPy engine if the Numba engine cannot be used."""
+
+    if args.engine == "numba":
+        from . import jit_simulation
+    if args.engine == "numba" and jit_simulation.numba is None:
+        print("WARNING - Numba not installed, using NumPy engine")
+        args.engine = "numpy"
+    if args.engine == "numba" and args.propagation == "fractional":
+        print("WARNING - Numba engine does not support fractional propagation, using NumPy engine")
+        args.engine = "numpy"
+    if args.engine == "numba" and args.checkpoint_state:
+        print("WARNING - Numba engine does not checkpoint in-flight state, only completed coupling lengths")
 
 def run_max_amps(args):
     """Run the maximum RR amplitude mode."""
@@ -24,46 +160,58 @@ def run_max_amps(args):
     if np.floor(np.log10(abs(1/args.step_wg_length))) > np.floor(np.log10(abs(args.datapoint_density))):
         raise ValueError("Datapoint density too small for specified waveguide length step size!")
     
+    check_engine(args)
+
     # Generate input waveguide lengths array
     wg_lengths = np.arange(args.min_wg_length, args.max_wg_length, args.step_wg_length)
 
-    max_amps = []
-    # Iterate coupling lengths
-    for i in range(len(wg_lengths)):
-        # Update the iteration counter after each complete simulation
-        print_iter(i, len(wg_lengths), args.print_freq)
-
-        # Initialise simulation and then run for specific coupling length
-        cfg, saw_wg, saw_rr = init_sim(args, wg_lengths[i])
-        max_amp = iter_max_amps(args, cfg, saw_wg, saw_rr)
-
-        # Append maximum SAW amplitude in RR to array of values for all coupling lengths
-        max_amps.append(max_amp)
-
-    # Normalise maximum amplitudes
-    max_amp_norm_factor = 1 / np.max(max_amps)
-    norm_max_amps = np.array(max_amps) * max_amp_norm_factor
-
-    # Generate plot
-    plt.plot(wg_lengths, norm_max_amps)
-    plt.xlim(0, args.max_wg_length-args.step_wg_length)
-    plt.ylim(0, 1.05)
-    plt.title("Variation in Maximum RR SAW Amplitude\nWith Coupling Length Between Input and RR")
-    plt.xlabel("Coupling Length (Number of SAW Wavelengths)")
-    plt.ylabel("Normalised Maximum SAW Amplitude")
-    cfg_text = (f"SAW velocity in input: {args.wg_vel} (arb.)\n"
-                f"SAW velocity in RR: {args.rr_vel} (arb.)\n"
-                f"Input to RR coupling coefficient: {args.wg2rr_coupl}\n"
-                f"RR to input coupling coefficient: {args.rr2wg_coupl}\n"
-                f"Input to RR loss coefficient: {args.wg2rr_loss}\n"
-                f"RR to input loss coefficient: {args.rr2wg_loss}\n"
-                f"SAW decay coefficient: {args.rr_decay_exp}\n"
-                )
-    plt.text(0.98, 0, cfg_text, ha='right', va='bottom', transform=plt.gca().transAxes)
-    plt.tight_layout()
-
-    # Save plot with timestamp
+    if args.dry_run:
+        return
+
+    # Simulate all coupling lengths
+    max_amps, num_iters = sweep_max_amps(args, wg_lengths)
+
+    # Report number of iterations used
+    print(f"Iterations used: {num_iters.min()}-{num_iters.max()} (total {num_iters.sum()})")
+    if args.conv_tol and np.any(num_iters == args.max_iterations):
+        print(f"WARNING - {np.sum(num_iters == args.max_iterations)} coupling lengths did not converge "
+              f"within {args.max_iterations} iterations")
+
+    # Save results with timestamp
     timestamp = datetime.datetime.now().strftime("%m%d-%H%M%S")
-    filename = f"{args.output_dir}max-amps-{timestamp}.png"
-    plt.savefig(filename, format='png', dpi=300)
-    print(f"Saved: {filename}")
+    filename = f"{args.output_dir}max-amps-{timestamp}"
+    np.savetxt(f"{filename}.csv", np.column_stack((wg_lengths, max_amps, num_iters)), delimiter=',',
+               header="wg_length,max_amp,iterations", comments='', fmt=['%.10g', '%.10g', '%d'])
+    print(f"Saved: {filename}.csv")
+
+    if args.no_plot:
+        return
+
+    with stage('plot'):
+        plt = get_pyplot()
+
+        # Normalise maximum amplitudes
+        max_amp_norm_factor = 1 / np.max(max_amps)
+        norm_max_amps = np.array(max_amps) * max_amp_norm_factor
+
+        # Generate plot
+        plt.plot(wg_lengths, norm_max_amps)
+        plt.xlim(0, args.max_wg_length-args.step_wg_length)
+        plt.ylim(0, 1.05)
+        plt.title("Variation in Maximum RR SAW Amplitude\nWith Coupling Length Between Input and RR")
+        plt.xlabel("Coupling Length (Number of SAW Wavelengths)")
+        plt.ylabel("Normalised Maximum SAW Amplitude")
+        cfg_text = (f"SAW velocity in input: {args.wg_vel} (arb.)\n"
+                    f"SAW velocity in RR: {args.rr_vel} (arb.)\n"
+                    f"Input to RR coupling coefficient: {args.wg2rr_coupl}\n"
+                    f"RR to input coupling coefficient: {args.rr2wg_coupl}\n"
+                    f"Input to RR loss coefficient: {args.wg2rr_loss}\n"
+                    f"RR to input loss coefficient: {args.rr2wg_loss}\n"
+                    f"SAW decay coefficient: {args.rr_decay_exp}\n"
+                    )
+        plt.text(0.98, 0, cfg_text, ha='right', va='bottom', transform=plt.gca().transAxes)
+        plt.tight_layout()
+
+        # Save plot
+        plt.savefig(f"{filename}.png", format='png', dpi=300)
+        print(f"Saved: {filename}.png")
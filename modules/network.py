@@ -0,0 +1,251 @@
+import datetime
+import json
+import numpy as np
+
+from .simulation import init_source, get_source, check_conv, print_iter
+from .profiling import profiled
+from .plotting import get_pyplot
+
+def load_network(path):
+    """Load a network description of waveguides, rings and the coupling regions between them.
+
+    The description is JSON with "waveguides" and "rings" mapping names to
+    element properties, and a list of "couplings". Waveguides are open, so
+    SAWs leave at their end, and any with "source" set are driven at their
+    start. Rings are closed. Each coupling couples a region of its "from"
+    element to a region of its "to" element.
+    """
+
+    with open(path) as f:
+        network = json.load(f)
+    for key in ["waveguides", "rings", "couplings"]:
+        network.setdefault(key, {} if key != "couplings" else [])
+    return network
+
+def get_window(args, length, edge_length):
+    """Get the coupling strength along a coupling region, rising and falling over half the edge length at each end."""
+
+    num_mid_datapoints = int(round(length * args.datapoint_density))
+    half_num_edge_datapoints = int(round(edge_length * args.datapoint_density)) // 2
+    return np.concatenate((
+        0.5 * (1 + np.sin(np.linspace(-np.pi/2, np.pi/2, half_num_edge_datapoints))),
+        np.ones(num_mid_datapoints),
+        0.5 * (1 - np.sin(np.linspace(-np.pi/2, np.pi/2, half_num_edge_datapoints)))
+    ))
+
+@profiled
+def init_network(args, network):
+    """Initialise a network simulation.
+
+    Every element is stored end to end in a single state array, followed by
+    one datapoint that is always zero. Each iteration then moves every SAW
+    with a single gather, and applies every coupling region at once by
+    gathering and scattering the datapoints they couple.
+    """
+
+    delta_t = 1 / args.fps
+    if args.propagation == "fractional":
+        print("WARNING - Network mode does not support fractional propagation, using integer propagation")
+
+    # Lay out elements end to end, with properties defaulting to the input waveguide and RR arguments
+    elements = {}
+    offset = 0
+    for kind, defaults in [("waveguides", (args.wg_vel, args.wg_decay_exp)), ("rings", (args.rr_vel, args.rr_decay_exp))]:
+        for name, props in network[kind].items():
+            if name in elements:
+                raise ValueError(f"Network element names must be unique, {name} is repeated!")
+            num_datapoints = int(round(props['length'] * args.datapoint_density))
+            vel = props.get('vel', defaults[0])
+            roll = int(delta_t * args.datapoint_density * vel)
+            if roll >= num_datapoints:
+                raise ValueError(f"Network element {name} is shorter than the distance SAWs move per iteration!")
+            elements[name] = {'kind': kind, 'offset': offset, 'num_datapoints': num_datapoints, 'vel': vel, 'roll': roll,
+                              'decay': 1 - 0.1 ** props.get('decay_exp', defaults[1]),
+                              'source': bool(props.get('source', False))}
+            offset += num_datapoints
+    num_state = offset
+
+    # Each SAW moves along by its roll; datapoints entering a waveguide are taken from the zero datapoint
+    travel_idxs = np.arange(num_state + 1)
+    decay = np.ones(num_state + 1, dtype=args.dtype)
+    for element in elements.values():
+        idxs = np.arange(element['num_datapoints']) - element['roll']
+        if element['kind'] == "rings":
+            idxs %= element['num_datapoints']
+        travel_idxs[element['offset']:element['offset'] + element['num_datapoints']] = np.where(
+            idxs >= 0, element['offset'] + idxs, num_state)
+        decay[element['offset']:element['offset'] + element['num_datapoints']] = element['decay']
+
+    # Gather coupled datapoints of every coupling region, with coefficients scaled by the window
+    coupl = {key: [] for key in ['from_idxs', 'to_idxs', 'coupl', 'loss', 'back_coupl', 'back_loss']}
+    coupled = np.zeros(num_state, dtype=bool)
+    for region in network['couplings']:
+        for end in ['from', 'to']:
+            if region[end] not in elements:
+                raise ValueError(f"Coupling {end} unknown network element {region[end]}!")
+        window = get_window(args, region.get('length', args.wg_length), region.get('edge_length', args.wg_edge_length))
+        for end in ['from', 'to']:
+            element = elements[region[end]]
+            start = int(round(region.get(f'{end}_position', 0) * args.datapoint_density))
+            idxs = np.arange(start, start + len(window))
+            if element['kind'] == "rings" and len(idxs) > element['num_datapoints']:
+                raise ValueError(f"Coupling region is longer than ring {region[end]}!")
+            if element['kind'] == "rings":
+                idxs %= element['num_datapoints']
+            elif idxs[-1] >= element['num_datapoints']:
+                raise ValueError(f"Coupling region runs past the end of waveguide {region[end]}!")
+            idxs += element['offset']
+            if np.any(coupled[idxs]):
+                raise ValueError(f"Coupling regions of network element {region[end]} overlap!")
+            coupled[idxs] = True
+            coupl[f'{end}_idxs'].append(idxs)
+        coupl['coupl'].append(region.get('coupl', args.wg2rr_coupl) * window)
+        coupl['loss'].append(region.get('loss', args.wg2rr_loss) * window)
+        coupl['back_coupl'].append(region.get('back_coupl', args.rr2wg_coupl) * window)
+        coupl['back_loss'].append(region.get('back_loss', args.rr2wg_loss) * window)
+    for key, values in coupl.items():
+        dtype = int if key.endswith('idxs') else args.dtype
+        coupl[key] = np.concatenate(values).astype(dtype) if values else np.zeros(0, dtype=dtype)
+
+    # Coupled datapoints are gathered into one buffer, from datapoints then to datapoints, and scattered back
+    coupl['idxs'] = np.concatenate((coupl.pop('from_idxs'), coupl.pop('to_idxs')))
+    coupl['values'] = np.zeros(len(coupl['idxs']), dtype=args.dtype)
+    coupl['from_values'], coupl['to_values'] = np.split(coupl['values'], 2)
+
+    # Driven waveguides are overwritten by the source over the first roll of datapoints, at their own velocity
+    sources = [element for element in elements.values() if element['source']]
+    gen_idxs = np.concatenate([source['offset'] + np.arange(source['roll']) for source in sources] or [np.zeros(0, dtype=int)])
+    x_gen = np.concatenate([np.arange(source['roll']) / args.datapoint_density for source in sources] or [np.zeros(0)])
+    phase_steps = np.concatenate([np.full(source['roll'], delta_t * source['vel']) for source in sources] or [np.zeros(0)])
+
+    # Check convergence once every round trip of the longest ring
+    rings = [element for element in elements.values() if element['kind'] == "rings"]
+    conv_period = max([int(np.ceil(ring['num_datapoints'] / max(1, ring['roll']))) for ring in rings] or [1])
+
+    cfg = {'delta_t': delta_t,
+           'elements': elements,
+           'num_state': num_state,
+           'offsets': np.array([element['offset'] for element in elements.values()]),
+           'travel_idxs': travel_idxs,
+           'decay': decay,
+           'coupl': coupl,
+           'gen_idxs': gen_idxs,
+           'source': init_source(x_gen, phase_steps, args.frequency, args.dtype),
+           'conv_period': conv_period,
+           'scratch': np.empty(num_state + 1, dtype=args.dtype)}
+
+    state = np.zeros(num_state + 1, dtype=args.dtype)
+    return cfg, state
+
+def iter_network(args, cfg, state, i):
+    """Perform a single iteration of every element of the network.
+
+    Every coupling region is applied at once, in the same order of coupling
+    and loss as iter_sim.
+    """
+
+    coupl = cfg['coupl']
+    from_values, to_values = coupl['from_values'], coupl['to_values']
+
+    # SAW generation, starting once the first SAW has moved into the driven waveguides
+    if i > 0:
+        state[cfg['gen_idxs']] = get_source(cfg['source'], i)
+
+    # Coupling and loss from each region's from element to its to element and back
+    np.take(state, coupl['idxs'], out=coupl['values'])
+    to_values += coupl['coupl'] * from_values
+    if not args.no_loss:
+        from_values -= coupl['loss'] * from_values
+    if not args.no_rr2wg:
+        from_values += coupl['back_coupl'] * to_values
+        if not args.no_loss:
+            to_values -= coupl['back_loss'] * to_values
+    state[coupl['idxs']] = coupl['values']
+
+    # Travelling SAW and decay
+    np.take(state, cfg['travel_idxs'], out=cfg['scratch'])
+    cfg['scratch'], state = state, cfg['scratch']
+    state *= cfg['decay']
+
+    return state
+
+def get_element_saws(cfg, state):
+    """Get the SAW of every element of the network as a dictionary of names to arrays."""
+
+    return {name: state[element['offset']:element['offset'] + element['num_datapoints']]
+            for name, element in cfg['elements'].items()}
+
+@profiled
+def network_max_amps(args, cfg, state):
+    """Get the maximum SAW value of every element of the network, iterating until they all converge.
+
+    Returns the maximum values in element order, the number of iterations
+    used and the final state.
+    """
+
+    max_iters = args.max_iterations if args.conv_tol else args.iterations
+    max_amps = np.full(len(cfg['elements']), -np.inf)
+    prev_max_amps, prev_rises, num_conv = np.zeros(len(max_amps)), np.zeros(len(max_amps)), np.zeros(len(max_amps), dtype=int)
+
+    for i in range(max_iters):
+        print_iter(i, max_iters, args.print_freq)
+        state = iter_network(args, cfg, state, i)
+        np.maximum(max_amps, np.maximum.reduceat(state[:cfg['num_state']], cfg['offsets']), out=max_amps)
+
+        # Stop once every element has converged for two consecutive periods
+        if args.conv_tol and (i + 1) % cfg['conv_period'] == 0:
+            converged, prev_rises = check_conv(args, max_amps, prev_max_amps, prev_rises)
+            num_conv = np.where(converged, num_conv + 1, 0)
+            prev_max_amps = max_amps.copy()
+            if np.all(num_conv >= 2):
+                if i + 1 >= args.print_freq:
+                    print()  # End progress line
+                return max_amps, i + 1, state
+
+    return max_amps, max_iters, state
+
+def run_network(args):
+    """Run the network mode."""
+
+    if not args.network:
+        raise ValueError("Network mode requires a network description (--network)!")
+
+    cfg, state = init_network(args, load_network(args.network))
+    print("Network: " + ', '.join(f"{name} ({element['num_datapoints']} datapoints)"
+                                  for name, element in cfg['elements'].items()))
+    print(f"Coupled datapoints: {len(cfg['coupl']['idxs'])}")
+
+    if args.dry_run:
+        return
+
+    # Simulate network
+    max_amps, num_iters, state = network_max_amps(args, cfg, state)
+    print(f"Iterations used: {num_iters}")
+    if args.conv_tol and num_iters == args.max_iterations:
+        print(f"WARNING - Network did not converge within {args.max_iterations} iterations")
+    print("Maximum SAW amplitudes:")
+    for name, max_amp in zip(cfg['elements'], max_amps):
+        print(f"    {name}: {max_amp:.6g}")
+
+    # Save maximum amplitudes and final SAWs with timestamp
+    timestamp = datetime.datetime.now().strftime("%m%d-%H%M%S")
+    filename = f"{args.output_dir}network-{timestamp}"
+    saws = get_element_saws(cfg, state)
+    np.savez(f"{filename}.npz", names=np.array(list(cfg['elements'])), max_amps=max_amps, num_iters=num_iters, **saws)
+    print(f"Saved: {filename}.npz")
+
+    if args.no_plot:
+        return
+
+    # Plot final SAW of every element
+    plt = get_pyplot()
+    fig, axs = plt.subplots(len(saws), 1, figsize=(8, 1.5 * len(saws) + 1), sharey=True, squeeze=False)
+    for ax, (name, saw), max_amp in zip(axs[:, 0], saws.items(), max_amps):
+        ax.plot(np.arange(len(saw)) / args.datapoint_density, saw, lw=1)
+        ax.set_ylabel(name)
+        ax.text(0.98, 0.95, f"Maximum amplitude: {max_amp:.4g}", ha='right', va='top', transform=ax.transAxes)
+    axs[-1, 0].set_xlabel("Position (SAW Wavelengths)")
+    fig.suptitle("SAWs in Resonator Network")
+    fig.tight_layout()
+    fig.savefig(f"{filename}.png", format='png', dpi=300)
+    print(f"Saved: {filename}.png")
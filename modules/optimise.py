@@ -0,0 +1,140 @@
+import argparse
+import datetime
+import numpy as np
+from scipy.optimize import minimize, minimize_scalar
+
+from .simulation import init_sim
+from .maximum_amplitude import sweep_max_amps, check_engine
+from .grid_sweep import GRID_PARAMS
+from .plotting import get_pyplot
+
+def parse_bounds(spec):
+    """Parse the bounds of a parameter to optimise given as NAME=MIN:MAX."""
+
+    name, sep, bounds = spec.partition('=')
+    name = name.strip().replace('-', '_')
+    if not sep or name not in GRID_PARAMS or bounds.count(':') != 1:
+        raise ValueError(f"Optimised parameter must be NAME=MIN:MAX with NAME one of {', '.join(GRID_PARAMS)}!")
+
+    low, high = (float(bound) for bound in bounds.split(':'))
+    if low >= high:
+        raise ValueError(f"Lower bound of {name} must be smaller than upper bound!")
+    return name, (low, high)
+
+def optimise_max_amp(args, bounds):
+    """Find the parameters maximising the maximum RR amplitude within bounds.
+
+    bounds is a list of (name, (low, high)) pairs, starting with wg_length.
+    Coupling length is first seeded with args.opt_seeds evenly spaced points.
+    Returns the optimum parameters, its maximum amplitude and every point
+    evaluated as (parameters, maximum amplitude, iterations).
+    """
+
+    names = [name for name, _ in bounds]
+    lows, highs = np.array([bound for _, bound in bounds]).T
+    trace, evaluated = [], {}
+
+    def evaluate(params, wg_lengths):
+        # Coupling lengths are rounded to the datapoint grid, so only simulate each once
+        points = [np.array([round(wg_length * args.datapoint_density) / args.datapoint_density, *params[1:]])
+                  for wg_length in wg_lengths]
+        new_points = list({tuple(point): point for point in points if tuple(point) not in evaluated}.values())
+        if new_points:
+            # Simulate through the sweep engine so points are batched and cached
+            point_args = argparse.Namespace(**{**vars(args), **dict(zip(names[1:], params[1:]))})
+            max_amps, num_iters = sweep_max_amps(point_args, [point[0] for point in new_points])
+            for point, max_amp, point_num_iters in zip(new_points, max_amps, num_iters):
+                evaluated[tuple(point)] = (max_amp, point_num_iters)
+                trace.append((point, max_amp, point_num_iters))
+                print(f"Evaluation {len(trace)}: " + ', '.join(f"{name}={value:.6g}" for name, value in zip(names, point))
+                      + f", maximum amplitude: {max_amp:.6g}")
+        return [evaluated[tuple(point)][0] for point in points]
+
+    def objective(params):
+        params = np.clip(params, lows, highs)
+        return -evaluate(params, [params[0]])[0]
+
+    # Seed coupling length to start the local search from the highest peak, not the nearest
+    seed_step = (highs[0] - lows[0]) / args.opt_seeds
+    seeds = lows[0] + (np.arange(args.opt_seeds) + 0.5) * seed_step
+    start = (lows + highs) / 2
+    start[0] = seeds[np.argmax(evaluate(start, seeds))]
+
+    if len(bounds) == 1:
+        # Bounded Brent search for coupling length alone around the best seed
+        low, high = max(start[0] - seed_step, lows[0]), min(start[0] + seed_step, highs[0])
+        result = minimize_scalar(lambda wg_length: objective(np.array([wg_length])), bounds=(low, high),
+                                 method='bounded', options={'xatol': args.opt_tol * (highs[0] - lows[0]),
+                                                            'maxiter': args.max_evals})
+    else:
+        # Nelder-Mead on parameters scaled to the unit hypercube, no finer than the datapoint grid
+        x0 = (start - lows) / (highs - lows)
+        simplex = np.vstack([x0] + [np.where(np.arange(len(bounds)) == k, np.clip(x0 + 0.1, 0, 1) if x0[k] < 0.9
+                                             else x0 - 0.1, x0) for k in range(len(bounds))])
+        xatol = max(args.opt_tol, 1 / (args.datapoint_density * (highs[0] - lows[0])))
+        result = minimize(lambda x: objective(lows + x * (highs - lows)), x0, method='Nelder-Mead',
+                          bounds=[(0, 1)] * len(bounds),
+                          options={'xatol': xatol, 'initial_simplex': simplex, 'maxfev': args.max_evals})
+
+    # Report the best point evaluated, which the optimiser's final point is rounded to
+    best = max(trace, key=lambda point: point[1])
+    if not result.success:
+        print(f"WARNING - Optimiser did not converge: {result.message}")
+    return dict(zip(names, best[0])), best[1], trace
+
+def run_optimise(args):
+    """Run the optimise mode."""
+
+    # Coupling length is always optimised, optionally with other parameters
+    bounds = [('wg_length', (args.min_wg_length, args.max_wg_length))]
+    bounds += [parse_bounds(spec) for spec in args.optimise or []]
+    names = [name for name, _ in bounds]
+    if len(set(names)) < len(names):
+        raise ValueError("Optimised parameters must all be different!")
+    if args.opt_seeds < 1:
+        raise ValueError("Number of seed coupling lengths must be at least 1!")
+
+    check_engine(args)
+
+    if args.dry_run:
+        init_sim(args, args.max_wg_length)
+        return
+
+    # Find optimum
+    optimum, max_amp, trace = optimise_max_amp(args, bounds)
+    print(f"Evaluations: {len(trace)}")
+    print("Optimum: " + ', '.join(f"{name}={value:.6g}" for name, value in optimum.items()))
+    print(f"Maximum RR amplitude: {max_amp:.6g}")
+
+    # Save trace of evaluated points with timestamp
+    params = np.array([point[0] for point in trace])
+    max_amps = np.array([point[1] for point in trace])
+    num_iters = np.array([point[2] for point in trace])
+    timestamp = datetime.datetime.now().strftime("%m%d-%H%M%S")
+    filename = f"{args.output_dir}optimise-{timestamp}"
+    np.savetxt(f"{filename}.csv", np.column_stack((params, max_amps, num_iters)), delimiter=',',
+               header=','.join(names + ['max_amp', 'iterations']), comments='',
+               fmt=['%.10g'] * (len(names) + 1) + ['%d'])
+    print(f"Saved: {filename}.csv")
+
+    if args.no_plot:
+        return
+
+    # Plot trace of evaluated points
+    plt = get_pyplot()
+    fig, axs = plt.subplots(1, 2, figsize=(10, 4))
+    axs[0].plot(np.arange(1, len(trace) + 1), max_amps, '.-')
+    axs[0].set_xlabel("Evaluation")
+    axs[0].set_ylabel("Maximum SAW Amplitude (arb.)")
+    sc = axs[1].scatter(params[:, 0], params[:, 1] if len(names) > 1 else max_amps,
+                        c=np.arange(len(trace)), cmap='viridis', s=12)
+    axs[1].plot(optimum['wg_length'], optimum[names[1]] if len(names) > 1 else max_amp, 'rx')
+    axs[1].set_xlabel("Coupling Length (Number of SAW Wavelengths)")
+    axs[1].set_ylabel(names[1] if len(names) > 1 else "Maximum SAW Amplitude (arb.)")
+    fig.colorbar(sc, ax=axs[1], label="Evaluation")
+    fig.suptitle("Optimisation of Maximum RR SAW Amplitude")
+    fig.tight_layout()
+
+    # Save plot
+    fig.savefig(f"{filename}.png", format='png', dpi=300)
+    print(f"Saved: {filename}.png")
@@ -0,0 +1,11 @@
+def get_pyplot():
+    """Import pyplot with the non-interactive Agg backend, only once a plot is actually made.
+
+    Importing Matplotlib is a large share of start-up time, so modes import
+    it through this only when plotting.
+    """
+
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
@@ -0,0 +1,123 @@
+import contextlib
+import datetime
+import functools
+import json
+import time
+import tracemalloc
+
+# Profiling state; instrumented code only checks state['enabled'] when profiling is off
+state = {'enabled': False}
+
+def start_profile(args):
+    """Start collecting stage timings, and allocations if profiling memory."""
+
+    state.update(enabled=True, memory=args.profile == "memory", stack=(args.mode,), stages={},
+                 start=time.perf_counter())
+    if state['memory']:
+        tracemalloc.start()
+
+def record_stage(stack, seconds, alloc_bytes):
+    """Add a call of a stage to its totals."""
+
+    totals = state['stages'].setdefault(stack, [0.0, 0, 0])
+    totals[0] += seconds
+    totals[1] += 1
+    totals[2] += alloc_bytes
+
+@contextlib.contextmanager
+def stage(name):
+    """Time a block of code as a stage nested in the current stage."""
+
+    if not state['enabled']:
+        yield
+        return
+
+    parent = state['stack']
+    state['stack'] = parent + (name,)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(state['stack'], time.perf_counter() - start, 0)
+        state['stack'] = parent
+
+def profiled(func):
+    """Time every call of a function as a stage."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not state['enabled']:
+            return func(*args, **kwargs)
+        with stage(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+def start_laps(name):
+    """Start timing consecutive stages of a hot loop body, cheaper than nesting a stage for each."""
+
+    laps = {'stack': state['stack'] + (name,), 'time': time.perf_counter()}
+    if state['memory']:
+        tracemalloc.reset_peak()
+        laps['memory'] = tracemalloc.get_traced_memory()[0]
+    return laps
+
+def lap(laps, name):
+    """Record the time since the previous lap, and the memory allocated at its peak, as a stage."""
+
+    seconds = time.perf_counter() - laps['time']
+    alloc_bytes = 0
+    if state['memory']:
+        current, peak = tracemalloc.get_traced_memory()
+        alloc_bytes = peak - laps['memory']
+        tracemalloc.reset_peak()
+        laps['memory'] = current
+    record_stage(laps['stack'] + (name,), seconds, alloc_bytes)
+
+    # Restart timer after bookkeeping so it is not included in the next lap
+    laps['time'] = time.perf_counter()
+
+def finish_profile(args):
+    """Print a summary of every stage and save it as JSON and in folded-stack format for flame graphs."""
+
+    total = time.perf_counter() - state['start']
+    stages = dict(state['stages'])
+
+    # Loops timed with laps have no stage of their own, so total their laps
+    for stack, (seconds, calls, alloc_bytes) in state['stages'].items():
+        if stack[:-1] not in state['stages'] and len(stack) > 2:
+            totals = stages.setdefault(stack[:-1], [0.0, 0, 0])
+            totals[0] += seconds
+            totals[1] = max(totals[1], calls)
+            totals[2] += alloc_bytes
+    if state['memory']:
+        tracemalloc.stop()
+
+    # Time of a stage not spent in its nested stages
+    self_seconds = {stack: totals[0] for stack, totals in stages.items()}
+    for stack, totals in stages.items():
+        if stack[:-1] in self_seconds:
+            self_seconds[stack[:-1]] -= totals[0]
+
+    print(f"Profile ({total:.3f} s total):")
+    for stack in sorted(stages):
+        seconds, calls, alloc_bytes = stages[stack]
+        line = (f"    {'  ' * (len(stack) - 2)}{stack[-1]:<{32 - 2 * len(stack)}} {seconds:10.4f} s "
+                f"{100 * seconds / total:6.1f}% {calls:>10} calls {1e6 * seconds / calls:12.3f} us/call")
+        if state['memory']:
+            line += f" {alloc_bytes / calls:12.0f} B/call"
+        print(line)
+
+    timestamp = datetime.datetime.now().strftime("%m%d-%H%M%S")
+    filename = f"{args.output_dir}profile-{timestamp}"
+    with open(f"{filename}.json", 'w') as f:
+        json.dump({'total_seconds': total,
+                   'stages': [{'stack': ';'.join(stack), 'seconds': seconds, 'self_seconds': self_seconds[stack],
+                               'calls': calls, 'alloc_bytes': alloc_bytes}
+                              for stack, (seconds, calls, alloc_bytes) in sorted(stages.items())]}, f, indent=4)
+    with open(f"{filename}.folded", 'w') as f:
+        for stack in sorted(stages):
+            f.write(f"{';'.join(stack)} {max(0, round(1e6 * self_seconds[stack]))}\n")
+    print(f"Saved: {filename}.json")
+    print(f"Saved: {filename}.folded")
+
+    state['enabled'] = False
@@ -1,7 +1,18 @@
+import fractions
+import math
+import types
 import numpy as np
 
-def init_sim(args, wg_length):
-    """Initialise the simulation."""
+from . import profiling
+from .profiling import profiled
+
+# Smallest RR scale factor before it is folded into the ring buffer, which holds the SAW divided by the scale
+# factor, so leave float32 buffers plenty of headroom before they overflow
+MIN_RR_SCALE = {'float64': 1e-100, 'float32': 1e-20}
+
+@profiled
+def init_sim(args, wg_length, source=True):
+    """Initialise the simulation, without precomputing the SAW source if source is False."""
 
     delta_t = 1 / args.fps
 
@@ -11,8 +22,10 @@ def init_sim(args, wg_length):
         print_iter_sim = True
 
     # Calculate array velocity
-    wg_roll = int(delta_t * args.datapoint_density * args.wg_vel)
-    rr_roll = int(delta_t * args.datapoint_density * args.rr_vel)
+    wg_shift = delta_t * args.datapoint_density * args.wg_vel
+    rr_shift = delta_t * args.datapoint_density * args.rr_vel
+    wg_roll, wg_interp = get_roll(args, wg_shift)
+    rr_roll, rr_interp = get_roll(args, rr_shift)
 
     wg_total_length = wg_length + args.wg_edge_length
 
@@ -21,7 +34,7 @@ def init_sim(args, wg_length):
     num_wg_edge_datapoints = int(round(args.wg_edge_length * args.datapoint_density))
     half_num_wg_edge_datapoints = num_wg_edge_datapoints // 2
     num_wg_datapoints = int(round(wg_total_length * args.datapoint_density))
-    num_gen_datapoints = half_num_wg_edge_datapoints + wg_roll
+    num_gen_datapoints = half_num_wg_edge_datapoints + wg_roll + (0 if wg_interp is None else 2)
     num_rr_datapoints = int(round(args.rr_length * args.datapoint_density))
 
     # Create window array to emulate the decrease in SAW coupling at edges of coupling region
@@ -29,9 +42,9 @@ def init_sim(args, wg_length):
         0.5 * (1 + np.sin(np.linspace(-np.pi/2, np.pi/2, half_num_wg_edge_datapoints))),
         np.ones(num_wg_mid_datapoints),
         0.5 * (1 - np.sin(np.linspace(-np.pi/2, np.pi/2, half_num_wg_edge_datapoints)))
-    ))
+    )).astype(args.dtype)
 
-    # Create position arrays
+    # Create position arrays (kept at full precision so the source phase stays accurate)
     x_wg = np.linspace(0, wg_total_length , num_wg_datapoints, endpoint=False)
     x_gen = x_wg[0:num_gen_datapoints]
     x_rr = np.linspace(0, args.rr_length, num_rr_datapoints, endpoint=False)
@@ -44,54 +57,223 @@ def init_sim(args, wg_length):
            'num_rr_datapoints': num_rr_datapoints,
            'wg_roll': wg_roll,
            'rr_roll': rr_roll,
+           'wg_shift': wg_roll if wg_interp is None else wg_shift,
+           'wg_interp': wg_interp,
+           'rr_interp': rr_interp,
            'window': window,
            'x_wg': x_wg,
            'x_gen': x_gen,
-           'x_rr': x_rr}
+           'x_rr': x_rr,
+           'rr_head': 0,
+           'rr_scale': 1.0,
+           'source': init_source(x_gen, delta_t * args.wg_vel, args.frequency, args.dtype) if source else None}
 
     # Initialise SAWs
-    saw_wg = np.zeros(num_wg_datapoints)
-    saw_rr = np.zeros(num_rr_datapoints)
+    saw_wg = np.zeros(num_wg_datapoints, dtype=args.dtype)
+    saw_rr = np.zeros(num_rr_datapoints, dtype=args.dtype)
 
     return cfg, saw_wg, saw_rr
 
 def iter_sim(args, cfg, saw_wg, saw_rr, i):
-    """Perform a single iteration of the simulation."""
+    """Perform a single iteration of the simulation.
+
+    The RR SAW is kept as a ring buffer with lazy decay; use get_saw_rr to read it.
+    """
+
+    # Time each stage only when profiling
+    laps = profiling.start_laps('iter_sim') if profiling.state['enabled'] else None
 
     # Update iteration counter if in animation mode (as it is slow)
     if cfg["print_iter_sim"]:
         print_iter(i, args.iterations, args.print_freq)
 
     # Gradually introduce SAW into input waveguide at same rate as SAW velocity
-    if i * cfg['wg_roll'] < len(cfg['x_gen']):
-        saw_wg[:i*cfg['wg_roll']] = np.sin(2 * np.pi * (cfg['x_gen'][:i*cfg['wg_roll']] - cfg['delta_t'] * args.wg_vel * i))  # SAW generation
-    else:
-        saw_wg[:len(cfg['x_gen'])] = np.sin(2 * np.pi * (cfg['x_gen'] - cfg['delta_t'] * args.wg_vel * i))  # SAW generation
+    num_gen = min(int(np.ceil(i * cfg['wg_shift'])), len(cfg['x_gen']))
+    saw_wg[:num_gen] = get_source(cfg['source'], i)[:num_gen]  # SAW generation
+    if laps:
+        profiling.lap(laps, 'generation')
 
     # Apply window array
     saw_wg *= cfg['window']
+    if laps:
+        profiling.lap(laps, 'window')
+
+    # RR is stored as a ring buffer; find the buffer slices holding the coupling region
+    rr_slices = get_rr_slices(cfg, 0, cfg['num_wg_datapoints'])
+    rr_scale = cfg['rr_scale']
 
     # WG to RR SAW coupling and loss
-    saw_rr[:cfg['num_wg_datapoints']] += args.wg2rr_coupl * saw_wg[:cfg['num_wg_datapoints']]  # Coupling
+    for rr_slice, wg_slice in rr_slices:
+        saw_rr[rr_slice] += (args.wg2rr_coupl / rr_scale) * saw_wg[wg_slice]  # Coupling
     if not args.no_loss:
         saw_wg[:cfg['num_wg_datapoints']] -= args.wg2rr_loss * saw_wg[:cfg['num_wg_datapoints']]  # Loss
+    if laps:
+        profiling.lap(laps, 'wg2rr_coupling')
 
     # RR to WG SAW coupling and loss
     if not args.no_rr2wg:
-        saw_wg[:cfg['num_wg_datapoints']] += args.rr2wg_coupl * saw_rr[:cfg['num_wg_datapoints']]  # Coupling
-        if not args.no_loss:
-            saw_rr[:cfg['num_wg_datapoints']] -= args.rr2wg_loss * saw_rr[:cfg['num_wg_datapoints']]  # Coupling
+        for rr_slice, wg_slice in rr_slices:
+            saw_wg[wg_slice] += (args.rr2wg_coupl * rr_scale) * saw_rr[rr_slice]  # Coupling
+            if not args.no_loss:
+                saw_rr[rr_slice] -= args.rr2wg_loss * saw_rr[rr_slice]  # Loss
+    if laps:
+        profiling.lap(laps, 'rr2wg_coupling')
 
-    # Travelling SAW
-    saw_wg = np.roll(saw_wg, cfg['wg_roll'])
-    saw_rr = np.roll(saw_rr, cfg['rr_roll'])
+    # Travelling SAW (RR moves its head instead of copying its data)
+    saw_wg = shift_saw(saw_wg, cfg['wg_roll'], cfg['wg_interp'])
+    cfg['rr_head'] = (cfg['rr_head'] - cfg['rr_roll']) % cfg['num_rr_datapoints']
+    if cfg['rr_interp'] is not None:
+        saw_rr = shift_saw(saw_rr, 0, cfg['rr_interp'])
+    if laps:
+        profiling.lap(laps, 'travel')
 
-    # SAW decay
+    # SAW decay (RR decay is accumulated into a global scale factor)
     saw_wg *= (1 - 0.1 ** args.wg_decay_exp)
-    saw_rr *= (1 - 0.1 ** args.rr_decay_exp)
+    cfg['rr_scale'] *= (1 - 0.1 ** args.rr_decay_exp)
+    renorm_rr(cfg, saw_rr)
+    if laps:
+        profiling.lap(laps, 'decay')
 
     return saw_wg, saw_rr
 
+def init_source(x_gen, phase_step, frequency=1, dtype="float64", max_table_size=2**20, block_size=2**16):
+    """Precompute the SAW source, sin(2 * pi * frequency * (x_gen - phase_step * i)), so no sines are evaluated while iterating.
+
+    If the source repeats after a whole number of iterations, a table of one
+    period is used. Otherwise blocks of consecutive iterations are computed
+    at once as they are needed. The phase is always computed in float64 and
+    the table stored as dtype.
+    """
+
+    source = {'x_gen': x_gen, 'phase_step': phase_step, 'frequency': frequency, 'dtype': dtype, 'period': None,
+              'start': 0, 'block_steps': max(1, block_size // max(1, x_gen.size))}
+
+    period = get_source_period(phase_step, frequency, max_table_size // max(1, x_gen.size))
+    if period is not None:
+        source['period'] = period
+        source['table'] = get_source_block(source, 0, period)
+        return source
+
+    source['table'] = get_source_block(source, 0, source['block_steps'])
+    return source
+
+def get_source_period(phase_step, frequency, max_period):
+    """Get the shortest number of iterations after which the source repeats, or None if it is longer than max_period.
+
+    The cycles advanced per iteration are approximated as fractions, so the
+    period is the lowest common multiple of their denominators.
+    """
+
+    if max_period < 1:
+        return None
+    cycles_per_iter = np.unique(np.ravel(np.multiply(phase_step, frequency)))
+    period = 1
+    for cycles in cycles_per_iter:
+        period = math.lcm(period, fractions.Fraction(float(cycles)).limit_denominator(max_period).denominator)
+        if period > max_period:
+            return None
+
+    # Check the period, as the fractions are only the closest with small denominators
+    cycles = period * cycles_per_iter
+    return period if np.all(np.abs(cycles - np.round(cycles)) < 1e-9) else None
+
+def get_source_block(source, start, num_steps):
+    """Get the source for a number of consecutive iterations at once, with iterations along the first axis."""
+
+    steps = np.arange(start, start + num_steps).reshape((-1,) + (1,) * source['x_gen'].ndim)
+    return np.sin(2 * np.pi * source['frequency'] * (source['x_gen'] - source['phase_step'] * steps)).astype(source['dtype'], copy=False)
+
+def get_source(source, i):
+    """Get the source at an iteration, computing the next block of iterations if it is not in the table."""
+
+    if source['period'] is not None:
+        return source['table'][i % source['period']]
+    if not source['start'] <= i < source['start'] + len(source['table']):
+        source['table'] = get_source_block(source, i, source['block_steps'])
+        source['start'] = i
+    return source['table'][i - source['start']]
+
+def get_roll(args, shift):
+    """Split the datapoints moved per iteration into an integer roll and fractional interpolation weights."""
+
+    if args.propagation == "integer" or shift == int(shift):
+        return int(shift), None
+
+    # Cubic Lagrange interpolation between the four datapoints around the fractional position
+    t = 1 - (shift - np.floor(shift))
+    interp = np.array([-t * (t - 1) * (t - 2) / 6,
+                       (t + 1) * (t - 1) * (t - 2) / 2,
+                       -(t + 1) * t * (t - 2) / 2,
+                       (t + 1) * t * (t - 1) / 6])
+    return int(np.floor(shift)), interp.astype(args.dtype)
+
+def shift_saw(saw, roll, interp):
+    """Move a SAW along by an integer roll, followed by a fractional shift if interpolating."""
+
+    if interp is None:
+        return np.roll(saw, roll, axis=-1)
+    return sum(weight * np.roll(saw, roll + 1 - m, axis=-1) for m, weight in zip(range(-1, 3), interp))
+
+def get_rr_slices(cfg, start, length):
+    """Get (buffer slice, logical slice) pairs of the RR ring buffer for a logical region."""
+
+    # Logical RR position j is stored at buffer position (j + rr_head) % num_rr_datapoints
+    num_rr = cfg['num_rr_datapoints']
+    buf_start = (cfg['rr_head'] + start) % num_rr
+    if buf_start + length <= num_rr:
+        return [(slice(buf_start, buf_start + length), slice(0, length))]
+    num_first = num_rr - buf_start
+    return [(slice(buf_start, num_rr), slice(0, num_first)),
+            (slice(0, length - num_first), slice(num_first, length))]
+
+def renorm_rr(cfg, saw_rr):
+    """Fold the RR scale factor back into the ring buffer before it underflows."""
+
+    if cfg['rr_scale'] < MIN_RR_SCALE[saw_rr.dtype.name]:
+        saw_rr *= cfg['rr_scale']
+        cfg['rr_scale'] = 1.0
+
+def get_saw_rr(cfg, saw_rr):
+    """Get the RR SAW in position order from the ring buffer."""
+
+    return cfg['rr_scale'] * np.roll(saw_rr, -cfg['rr_head'], axis=-1)
+
+def get_rr_max(cfg, saw_rr):
+    """Get the maximum RR SAW value written in the last iteration.
+
+    Only the coupling region changes other than by decay, so the running
+    maximum over these values equals the running maximum over the whole RR.
+    Fractional shifts change every value, so then the whole RR is used.
+    """
+
+    if cfg['rr_interp'] is not None:
+        return cfg['rr_scale'] * saw_rr.max(axis=-1)
+
+    rr_slices = get_rr_slices(cfg, cfg['rr_roll'], np.max(cfg['num_wg_datapoints']))
+    return cfg['rr_scale'] * np.max([saw_rr[..., rr_slice].max(axis=-1) for rr_slice, _ in rr_slices], axis=0)
+
+def get_conv_period(cfg):
+    """Get the number of iterations between convergence checks (one RR round trip)."""
+
+    if cfg['rr_roll'] == 0:
+        return int(np.ceil(1 / cfg['delta_t']))
+    return int(np.ceil(cfg['num_rr_datapoints'] / cfg['rr_roll']))
+
+def check_conv(args, max_amp, prev_max_amp, prev_rise):
+    """Check whether the maximum RR amplitude has converged over the last period.
+
+    The rise in maximum amplitude per period is assumed to shrink geometrically,
+    so the remaining rise is estimated from the last two rises.
+    """
+
+    rise = max_amp - prev_max_amp
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = rise / prev_rise
+        remaining_rise = np.where(ratio < 1, rise * ratio / (1 - ratio), np.inf)
+    converged = (rise == 0) | (remaining_rise <= args.conv_tol * max_amp)
+
+    return converged, rise
+
 def print_iter( i, total_i, print_freq):
     """Print the current iteration number"""
 
@@ -99,3 +281,178 @@ def print_iter( i, total_i, print_freq):
         print(f"\rProgress: {i+1}/{total_i}", end="\n")  # Final iteration; newline
     elif i % print_freq == print_freq - 1:
         print(f"\rProgress: {i+1}/{total_i}", end="")
+
+# Simulation parameters of the Simulation class, with the same defaults as the command line
+SIM_PARAMS = {'fps': 25, 'datapoint_density': 100, 'propagation': "integer", 'dtype': "float64",
+              'no_loss': False, 'no_rr2wg': False, 'frequency': 1, 'wg_edge_length': 1, 'wg_vel': 2,
+              'wg2rr_coupl': 0.01, 'wg2rr_loss': 0.02, 'wg_decay_exp': 3, 'rr_length': 15, 'rr_vel': 2,
+              'rr2wg_coupl': 0.01, 'rr2wg_loss': 0.02, 'rr_decay_exp': 3}
+
+def roll_into(out, saw, shift):
+    """Write a SAW moved along by an integer shift into out, like np.roll without allocating."""
+
+    shift %= len(saw)
+    if shift == 0:
+        out[:] = saw
+        return
+    out[shift:] = saw[:-shift]
+    out[:shift] = saw[-shift:]
+
+class Simulation:
+    """A single simulation that can be stepped repeatedly without an argparse namespace.
+
+    Parameters are any of SIM_PARAMS given as keyword arguments. Constants,
+    branches and buffers are set up by reset, so step and run match iter_sim
+    exactly without allocating arrays.
+    """
+
+    __slots__ = ('params', 'wg_length', 'cfg', 'saw_wg', 'ring', 'i', 'max_amp', 'wg_buf', 'rr_buf', 'scratch',
+                 'window', 'source', 'num_wg', 'num_rr', 'num_gen', 'wg_shift', 'wg_roll', 'wg_interp', 'rr_roll',
+                 'rr_interp', 'wg2rr_coupl', 'wg2rr_loss', 'rr2wg_coupl', 'rr2wg_loss', 'wg_decay', 'rr_decay',
+                 'min_rr_scale', 'loss', 'rr2wg', 'rr_head', 'rr_scale')
+
+    def __init__(self, wg_length=1, **params):
+        unknown = set(params) - set(SIM_PARAMS)
+        if unknown:
+            raise ValueError(f"Unknown simulation parameters: {', '.join(sorted(unknown))}!")
+        self.params = {**SIM_PARAMS, **params}
+        self.reset(wg_length)
+
+    @classmethod
+    def from_args(cls, args, wg_length=None):
+        """Create a simulation from the simulation parameters of a command line namespace."""
+
+        return cls(args.wg_length if wg_length is None else wg_length,
+                   **{key: getattr(args, key) for key in SIM_PARAMS})
+
+    def reset(self, wg_length=None):
+        """Restart from no SAWs, optionally with a new input waveguide length."""
+
+        if wg_length is not None:
+            self.wg_length = wg_length
+        self.cfg, self.saw_wg, self.ring = init_sim(types.SimpleNamespace(mode=None, **self.params), self.wg_length)
+        cfg, params = self.cfg, self.params
+
+        # Constants and branches used every iteration
+        self.window, self.source = cfg['window'], cfg['source']
+        self.num_wg, self.num_rr = cfg['num_wg_datapoints'], cfg['num_rr_datapoints']
+        self.num_gen = len(cfg['x_gen'])
+        self.wg_shift, self.wg_roll, self.wg_interp = cfg['wg_shift'], cfg['wg_roll'], cfg['wg_interp']
+        self.rr_roll, self.rr_interp = cfg['rr_roll'], cfg['rr_interp']
+        self.wg2rr_coupl, self.wg2rr_loss = params['wg2rr_coupl'], params['wg2rr_loss']
+        self.rr2wg_coupl, self.rr2wg_loss = params['rr2wg_coupl'], params['rr2wg_loss']
+        self.wg_decay = 1 - 0.1 ** params['wg_decay_exp']
+        self.rr_decay = 1 - 0.1 ** params['rr_decay_exp']
+        self.min_rr_scale = MIN_RR_SCALE[self.ring.dtype.name]
+        self.loss, self.rr2wg = not params['no_loss'], not params['no_rr2wg']
+
+        # Buffers to move SAWs into and for intermediate products
+        self.wg_buf, self.rr_buf = np.empty_like(self.saw_wg), np.empty_like(self.ring)
+        self.scratch = np.empty(max(self.num_wg, self.num_rr), dtype=self.ring.dtype)
+
+        self.i, self.max_amp, self.rr_head, self.rr_scale = 0, 0.0, 0, 1.0
+
+    def step(self):
+        """Perform a single iteration, as iter_sim."""
+
+        saw_wg, ring, scratch = self.saw_wg, self.ring, self.scratch
+        num_wg, num_rr = self.num_wg, self.num_rr
+
+        # SAW generation and window
+        num_gen = min(int(np.ceil(self.i * self.wg_shift)), self.num_gen)
+        saw_wg[:num_gen] = get_source(self.source, self.i)[:num_gen]
+        saw_wg *= self.window
+
+        # Buffer slices of the RR coupling region, which may wrap around the ring buffer
+        buf_start = self.rr_head
+        if buf_start + num_wg <= num_rr:
+            rr_slices = ((slice(buf_start, buf_start + num_wg), slice(0, num_wg)),)
+        else:
+            num_first = num_rr - buf_start
+            rr_slices = ((slice(buf_start, num_rr), slice(0, num_first)), (slice(0, num_wg - num_first), slice(num_first, num_wg)))
+
+        # WG to RR SAW coupling and loss
+        for rr_slice, wg_slice in rr_slices:
+            tmp = scratch[:wg_slice.stop - wg_slice.start]
+            np.multiply(self.wg2rr_coupl / self.rr_scale, saw_wg[wg_slice], out=tmp)
+            ring[rr_slice] += tmp
+        if self.loss:
+            tmp = scratch[:num_wg]
+            np.multiply(self.wg2rr_loss, saw_wg, out=tmp)
+            saw_wg -= tmp
+
+        # RR to WG SAW coupling and loss
+        if self.rr2wg:
+            for rr_slice, wg_slice in rr_slices:
+                tmp = scratch[:wg_slice.stop - wg_slice.start]
+                np.multiply(self.rr2wg_coupl * self.rr_scale, ring[rr_slice], out=tmp)
+                saw_wg[wg_slice] += tmp
+                if self.loss:
+                    np.multiply(self.rr2wg_loss, ring[rr_slice], out=tmp)
+                    ring[rr_slice] -= tmp
+
+        # Travelling SAW, swapping buffers instead of allocating new arrays
+        self.saw_wg, self.wg_buf = self.shift(saw_wg, self.wg_buf, self.wg_roll, self.wg_interp), saw_wg
+        self.rr_head = (self.rr_head - self.rr_roll) % num_rr
+        if self.rr_interp is not None:
+            self.ring, self.rr_buf = self.shift(ring, self.rr_buf, 0, self.rr_interp), ring
+
+        # SAW decay
+        self.saw_wg *= self.wg_decay
+        self.rr_scale *= self.rr_decay
+        if self.rr_scale < self.min_rr_scale:
+            self.ring *= self.rr_scale
+            self.rr_scale = 1.0
+
+        self.i += 1
+
+    def shift(self, saw, out, roll, interp):
+        """Move a SAW along into out, as shift_saw."""
+
+        if interp is None:
+            roll_into(out, saw, roll)
+            return out
+        tmp = self.scratch[:len(saw)]
+        for m, weight in zip(range(-1, 3), interp):
+            roll_into(tmp, saw, roll + 1 - m)
+            if m == -1:
+                np.multiply(weight, tmp, out=out)
+            else:
+                tmp *= weight
+                out += tmp
+        return out
+
+    def run(self, num_iters):
+        """Perform a number of iterations, returning the maximum RR SAW value so far."""
+
+        # Values written to the coupling region reach these buffer positions after moving
+        for _ in range(num_iters):
+            self.step()
+            if self.rr_interp is not None:
+                rr_max = self.ring.max()
+            else:
+                start = (self.rr_head + self.rr_roll) % self.num_rr
+                end = start + self.num_wg
+                rr_max = self.ring[start:end].max()
+                if end > self.num_rr:
+                    rr_max = max(rr_max, self.ring[:end - self.num_rr].max())
+            self.max_amp = max(self.max_amp, self.rr_scale * rr_max)
+        return self.max_amp
+
+    @property
+    def saw_rr(self):
+        """RR SAW in position order."""
+
+        return self.rr_scale * np.roll(self.ring, -self.rr_head)
+
+    @property
+    def x_wg(self):
+        """Input waveguide positions."""
+
+        return self.cfg['x_wg']
+
+    @property
+    def x_rr(self):
+        """RR positions."""
+
+        return self.cfg['x_rr']
@@ -0,0 +1,128 @@
+import datetime
+import numpy as np
+
+from .simulation import init_sim, iter_sim, print_iter, get_conv_period
+from .profiling import profiled, stage
+from .plotting import get_pyplot
+
+def init_pulse_source(args, cfg, num_iters):
+    """Replace the sinusoidal source with a Gaussian pulse travelling at the SAW velocity.
+
+    The pulse starts behind the generated SAW front so it is introduced
+    whole, and its spectrum covers frequencies up to a few times the drive
+    frequency.
+    """
+
+    delay = 5 * args.pulse_width
+    steps = np.arange(num_iters)[:, None]
+    table = np.exp(-0.5 * ((cfg['x_gen'] - cfg['delta_t'] * args.wg_vel * steps + delay) / args.pulse_width) ** 2)
+    cfg['source'] = {'x_gen': cfg['x_gen'], 'dtype': args.dtype, 'period': None, 'start': 0,
+                     'table': table.astype(args.dtype), 'block_steps': num_iters}
+
+@profiled
+def get_impulse_response(args, wg_length):
+    """Simulate a pulse through the coupling region, recording the input, ring and through-port time series.
+
+    The input is the source at the end of the generation region. The ring
+    and through port are the RR and input waveguide SAWs just after the
+    coupling region.
+    """
+
+    cfg, saw_wg, saw_rr = init_sim(args, wg_length, source=False)
+    num_iters = args.spectrum_iterations
+    init_pulse_source(args, cfg, num_iters)
+    rr_probe = cfg['num_wg_datapoints'] % cfg['num_rr_datapoints']
+
+    input_series = cfg['source']['table'][:, -1]
+    ring_series, through_series = np.zeros(num_iters), np.zeros(num_iters)
+    for i in range(num_iters):
+        print_iter(i, num_iters, args.print_freq)
+        saw_wg, saw_rr = iter_sim(args, cfg, saw_wg, saw_rr, i)
+        ring_series[i] = cfg['rr_scale'] * saw_rr[(rr_probe + cfg['rr_head']) % cfg['num_rr_datapoints']]
+        through_series[i] = saw_wg[-1]
+
+    return cfg, input_series, ring_series, through_series
+
+def get_spectrum(args, cfg, input_series, ring_series, through_series, min_input=1e-3):
+    """Get the ring and through-port transmission at every frequency the pulse covers.
+
+    Frequencies are relative to the drive frequency of the other modes, so
+    a SAW wavelength of one unit length is at frequency 1.
+    """
+
+    freqs = np.fft.rfftfreq(len(input_series), cfg['delta_t']) / args.wg_vel
+    input_fft = np.fft.rfft(input_series)
+
+    # Only keep frequencies with enough input to divide by
+    band = np.abs(input_fft) > min_input * np.abs(input_fft).max()
+    ring_trans = np.fft.rfft(ring_series)[band] / input_fft[band]
+    through_trans = np.fft.rfft(through_series)[band] / input_fft[band]
+
+    return freqs[band], ring_trans, through_trans
+
+def get_resonances(freqs, ring_trans, min_prominence=0.1):
+    """Find the ring resonances and their Q factors from the full width at half maximum power."""
+
+    from scipy.signal import find_peaks, peak_widths  # Slow to import, so only when needed
+
+    power = np.abs(ring_trans) ** 2
+    peaks, _ = find_peaks(power, prominence=min_prominence * power.max())
+    widths, _, left, right = peak_widths(power, peaks, rel_height=0.5)
+
+    # Convert widths from samples to frequency by interpolating the frequency axis
+    fwhms = np.interp(right, np.arange(len(freqs)), freqs) - np.interp(left, np.arange(len(freqs)), freqs)
+    return np.column_stack((freqs[peaks], np.abs(ring_trans[peaks]), fwhms, freqs[peaks] / fwhms))
+
+def run_spectrum(args):
+    """Run the spectrum mode."""
+
+    if args.dry_run:
+        init_sim(args, args.wg_length, source=False)
+        return
+
+    # Get transmission spectrum from the impulse response
+    cfg, input_series, ring_series, through_series = get_impulse_response(args, args.wg_length)
+    freqs, ring_trans, through_trans = get_spectrum(args, cfg, input_series, ring_series, through_series)
+    resonances = get_resonances(freqs, ring_trans)
+
+    # Resonances are broadened if the RR SAW is cut off before it has decayed
+    if np.abs(ring_series[-get_conv_period(cfg):]).max() > 1e-3 * np.abs(ring_series).max():
+        print("WARNING - RR SAW has not decayed by the end of the impulse response, increase --spectrum-iterations")
+
+    print(f"Frequency resolution: {freqs[1] - freqs[0]:.4g}")
+    print("Resonances:")
+    for freq, amp, fwhm, q_factor in resonances:
+        print(f"    Frequency: {freq:.5f}, ring amplitude: {amp:.4g}, FWHM: {fwhm:.4g}, Q factor: {q_factor:.1f}")
+
+    # Save spectrum and resonances with timestamp
+    timestamp = datetime.datetime.now().strftime("%m%d-%H%M%S")
+    filename = f"{args.output_dir}spectrum-{timestamp}"
+    np.savetxt(f"{filename}.csv", np.column_stack((freqs, np.abs(ring_trans), np.angle(ring_trans),
+                                                    np.abs(through_trans), np.angle(through_trans))),
+               delimiter=',', header="frequency,ring_amp,ring_phase,through_amp,through_phase", comments='', fmt='%.10g')
+    np.savetxt(f"{filename}-resonances.csv", resonances, delimiter=',', header="frequency,ring_amp,fwhm,q_factor",
+               comments='', fmt='%.10g')
+    print(f"Saved: {filename}.csv")
+    print(f"Saved: {filename}-resonances.csv")
+
+    if args.no_plot:
+        return
+
+    with stage('plot'):
+        plt = get_pyplot()
+
+        # Generate plot of transmission to ring and through port
+        fig, ax = plt.subplots(figsize=(10, 5))
+        ax.plot(freqs, 20 * np.log10(np.abs(ring_trans)), lw=1, label='Ring')
+        ax.plot(freqs, 20 * np.log10(np.abs(through_trans)), lw=1, label='Through port')
+        ax.plot(resonances[:, 0], 20 * np.log10(resonances[:, 1]), 'x', label='Resonances')
+        ax.axvline(1, color='grey', linestyle='--', lw=1)
+        ax.set_title("Transmission Spectrum of SAW Coupling")
+        ax.set_xlabel("Frequency (Relative to Drive Frequency)")
+        ax.set_ylabel("Transmission (dB)")
+        ax.legend(loc="lower right")
+        fig.tight_layout()
+
+        # Save plot
+        fig.savefig(f"{filename}.png", format='png', dpi=300)
+        print(f"Saved: {filename}.png")
@@ -0,0 +1,144 @@
+import datetime
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import spsolve
+
+from .simulation import init_sim
+from .profiling import profiled, stage
+from .plotting import get_pyplot
+
+def get_step_operator(args, cfg):
+    """Get the sparse matrix applying a single iteration after SAW generation.
+
+    The state vector is the input waveguide SAW followed by the RR SAW, both
+    in position order.
+    """
+
+    num_wg = cfg['num_wg_datapoints']
+    num_rr = cfg['num_rr_datapoints']
+    wg = np.arange(num_wg)
+
+    def couple(coeff, from_offset, to_offset):
+        # Add coeff times one waveguide's coupling region onto the other's
+        return sp.identity(num_wg + num_rr, format='csr') + sp.csr_matrix(
+            (np.full(num_wg, coeff), (to_offset + wg, from_offset + wg)), shape=(num_wg + num_rr, num_wg + num_rr))
+
+    def scale(wg_factors, rr_factors):
+        # Multiply the waveguides by a factor at every position
+        return sp.diags(np.concatenate((np.broadcast_to(wg_factors, num_wg), np.broadcast_to(rr_factors, num_rr))))
+
+    def roll(num, shift):
+        # Move every position along by the shift, wrapping around at the end
+        return sp.csr_matrix((np.ones(num), ((np.arange(num) + shift) % num, np.arange(num))), shape=(num, num))
+
+    def travel(num, shift, interp):
+        # Move every position along by the integer shift, then interpolate any fractional shift
+        if interp is None:
+            return roll(num, shift)
+        return sum(weight * roll(num, shift + 1 - m) for m, weight in zip(range(-1, 3), interp))
+
+    # Build operator in the same order as iter_sim
+    step = scale(cfg['window'], 1)  # Window
+    step = couple(args.wg2rr_coupl, 0, num_wg) @ step  # WG to RR coupling
+    if not args.no_loss:
+        step = scale(1 - args.wg2rr_loss, 1) @ step  # WG to RR loss
+    if not args.no_rr2wg:
+        step = couple(args.rr2wg_coupl, num_wg, 0) @ step  # RR to WG coupling
+        if not args.no_loss:
+            step = scale(1, np.where(np.arange(num_rr) < num_wg, 1 - args.rr2wg_loss, 1)) @ step  # RR to WG loss
+    step = sp.block_diag((travel(num_wg, cfg['wg_roll'], cfg['wg_interp']),
+                          travel(num_rr, cfg['rr_roll'], cfg['rr_interp']))) @ step  # Travelling SAW
+    step = scale(1 - 0.1 ** args.wg_decay_exp, 1 - 0.1 ** args.rr_decay_exp) @ step  # SAW decay
+
+    return step.tocsc()
+
+@profiled
+def solve_steady_state(args, wg_length):
+    """Solve for the periodic steady state of the simulation.
+
+    Once SAW generation is fully introduced, the state entering iteration i
+    is Im(phasor * exp(-1j * phase_step * i)); the phasors of the input
+    waveguide and RR SAWs are returned.
+    """
+
+    cfg, _, _ = init_sim(args, wg_length, source=False)  # Source is solved for directly, not tabulated
+    num_wg = cfg['num_wg_datapoints']
+    num_states = num_wg + cfg['num_rr_datapoints']
+    num_gen = len(cfg['x_gen'])
+
+    # SAW generation overwrites the start of the input waveguide with the source
+    step = get_step_operator(args, cfg)
+    not_gen = np.ones(num_states)
+    not_gen[:num_gen] = 0
+    source = np.zeros(num_states, dtype=complex)
+    source[:num_gen] = np.exp(2j * np.pi * args.frequency * cfg['x_gen'])
+
+    # Source phase advances by the same amount every iteration
+    phase_step = 2 * np.pi * cfg['delta_t'] * args.wg_vel * args.frequency
+    rotation = np.exp(1j * phase_step)
+
+    # Solve phasor = rotation * step @ (not_gen * phasor + source)
+    lhs = sp.identity(num_states, format='csc') - rotation * step @ sp.diags(not_gen)
+    phasor = spsolve(lhs.tocsc(), rotation * (step @ source))
+
+    cfg['phase_step'] = phase_step
+    return cfg, phasor[:num_wg], phasor[num_wg:]
+
+def steady_state_max_amp(args, wg_length):
+    """Get the steady-state maximum RR amplitude for a coupling length."""
+
+    _, _, phasor_rr = solve_steady_state(args, wg_length)
+    return np.abs(phasor_rr).max()
+
+def run_steady_state(args):
+    """Run the steady-state mode."""
+
+    if args.dry_run:
+        init_sim(args, args.wg_length, source=False)
+        return
+
+    # Solve steady state and get maximum RR amplitude
+    cfg, phasor_wg, phasor_rr = solve_steady_state(args, args.wg_length)
+    max_amp = np.abs(phasor_rr).max()
+    print(f"Steady-state maximum RR amplitude: {max_amp}")
+
+    # Save fields with timestamp
+    timestamp = datetime.datetime.now().strftime("%m%d-%H%M%S")
+    filename = f"{args.output_dir}steady-state-{timestamp}"
+    np.savez(f"{filename}.npz", x_wg=cfg['x_wg'], x_rr=cfg['x_rr'], phasor_wg=phasor_wg, phasor_rr=phasor_rr,
+             phase_step=cfg['phase_step'], max_amp=max_amp)
+    print(f"Saved: {filename}.npz")
+
+    if args.no_plot:
+        return
+
+    with stage('plot'):
+        plt = get_pyplot()
+
+        # Generate plot of SAW amplitudes and a snapshot of the SAWs
+        fig, ax = plt.subplots()
+        ax.set_xlim(0, args.rr_length)
+        ax.set_ylim(-2, 2)
+        ax.plot(cfg['x_wg'], phasor_wg.imag, lw=1, label='Input')
+        ax.plot(cfg['x_rr'], phasor_rr.imag, lw=1, label='Ring')
+        ax.plot(cfg['x_wg'], np.abs(phasor_wg), 'C0--', lw=1, label='Input amplitude')
+        ax.plot(cfg['x_rr'], np.abs(phasor_rr), 'C1--', lw=1, label='Ring amplitude')
+        ax.set_title("Steady State of SAW Coupling")
+        ax.set_xlabel("Waveguide Position (SAW Wavelengths)")
+        ax.set_ylabel("Amplitude (arb.)")
+        cfg_text = (f"SAW velocity in input: {args.wg_vel} (arb.)\n"
+                    f"SAW velocity in RR: {args.rr_vel} (arb.)\n"
+                    f"Input to RR coupling coefficient: {args.wg2rr_coupl}\n"
+                    f"RR to input coupling coefficient: {args.rr2wg_coupl}\n"
+                    f"Input to RR loss coefficient: {args.wg2rr_loss}\n"
+                    f"RR to input loss coefficient: {args.rr2wg_loss}\n"
+                    f"SAW decay coefficient: {args.rr_decay_exp}\n"
+                    f"Maximum RR amplitude: {max_amp:.4g}\n"
+                    )
+        ax.text(0.98, 0, cfg_text, ha='right', va='bottom', transform=ax.transAxes)
+        ax.legend(loc="upper right")
+        fig.tight_layout()
+
+        # Save plot
+        fig.savefig(f"{filename}.png", format='png', dpi=300)
+        print(f"Saved: {filename}.png")
@@ -0,0 +1,77 @@
+import datetime
+import json
+import sys
+import time
+
+# Peak memory is only available where the resource module is (not on Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def get_peak_memory():
+    """Get the peak resident memory of this process in MB, or None if unavailable."""
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3  # Bytes on macOS, kB elsewhere
+
+def run_chunk(func, *args):
+    """Run func on a chunk, also returning the peak memory of the process it ran in."""
+
+    return func(*args), get_peak_memory()
+
+def start_progress(args, total, label):
+    """Start tracking progress through a sweep of total points."""
+
+    progress = {'label': label, 'total': total, 'done': 0, 'steps': 0, 'start': time.perf_counter(),
+                'worker_peak_memory': None}
+    log_progress(args, progress, 'start')
+    return progress
+
+def update_progress(args, progress, num_points, num_steps, worker_peak_memory=None):
+    """Add completed points and simulation steps, printing and logging progress."""
+
+    progress['done'] += num_points
+    progress['steps'] += int(num_steps)
+    if worker_peak_memory is not None:
+        progress['worker_peak_memory'] = max(progress['worker_peak_memory'] or 0, worker_peak_memory)
+
+    stats = get_progress_stats(progress)
+    eta = "--:--:--" if stats['eta'] is None else str(datetime.timedelta(seconds=round(stats['eta'])))
+    memory = "" if stats['peak_memory'] is None else f" | peak {stats['peak_memory']:.0f} MB"
+    if progress['worker_peak_memory'] is not None:
+        memory += f" (workers {progress['worker_peak_memory']:.0f} MB)"
+    print(f"\rProgress: {progress['done']}/{progress['total']} | {stats['points_per_sec']:.3g} points/s | "
+          f"{stats['steps_per_sec']:.3g} steps/s | ETA {eta}{memory}",
+          end="\n" if progress['done'] == progress['total'] else "")
+
+    log_progress(args, progress, 'finish' if progress['done'] == progress['total'] else 'update')
+
+def get_progress_stats(progress):
+    """Get elapsed time, throughput, estimated time remaining and peak memory."""
+
+    elapsed = time.perf_counter() - progress['start']
+    points_per_sec = progress['done'] / elapsed if elapsed > 0 else 0
+    eta = (progress['total'] - progress['done']) / points_per_sec if points_per_sec > 0 else None
+    return {'elapsed': elapsed, 'points_per_sec': points_per_sec,
+            'steps_per_sec': progress['steps'] / elapsed if elapsed > 0 else 0,
+            'eta': eta, 'peak_memory': get_peak_memory()}
+
+def log_progress(args, progress, event):
+    """Append a progress record to the JSON-lines log, if one is given."""
+
+    if not args.progress_log:
+        return
+
+    stats = get_progress_stats(progress)
+    with open(args.progress_log, 'a') as f:
+        f.write(json.dumps({'time': datetime.datetime.now().isoformat(timespec='seconds'), 'event': event,
+                            'mode': args.mode, 'label': progress['label'], 'done': progress['done'],
+                            'total': progress['total'], 'steps': progress['steps'],
+                            'elapsed_seconds': stats['elapsed'], 'points_per_sec': stats['points_per_sec'],
+                            'steps_per_sec': stats['steps_per_sec'], 'eta_seconds': stats['eta'],
+                            'peak_memory_mb': stats['peak_memory'],
+                            'worker_peak_memory_mb': progress['worker_peak_memory'],
+                            'workers': args.workers}) + '\n')
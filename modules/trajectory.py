@@ -0,0 +1,85 @@
+import argparse
+import datetime
+import json
+import os
+import numpy as np
+
+from .simulation import init_sim, iter_sim, get_saw_rr, print_iter
+from .animation import init_anim_plot, save_anim
+
+def run_record(args):
+    """Run the record mode, saving SAW snapshots to memory-mapped files."""
+
+    # Initialise simulation
+    cfg, saw_wg, saw_rr = init_sim(args, args.wg_length)
+    iterations = np.arange(0, args.iterations, args.stride)
+
+    if args.dry_run:
+        return
+
+    # Create memory-mapped arrays with a snapshot after every stride iterations
+    timestamp = datetime.datetime.now().strftime("%m%d-%H%M%S")
+    dirname = f"{args.output_dir}trajectory-{timestamp}/"
+    os.makedirs(dirname)
+    traj_wg = np.lib.format.open_memmap(f"{dirname}saw_wg.npy", mode='w+', shape=(len(iterations), saw_wg.size))
+    traj_rr = np.lib.format.open_memmap(f"{dirname}saw_rr.npy", mode='w+', shape=(len(iterations), saw_rr.size))
+    np.save(f"{dirname}x_wg.npy", cfg['x_wg'])
+    np.save(f"{dirname}x_rr.npy", cfg['x_rr'])
+
+    # Save configuration alongside snapshots
+    with open(f"{dirname}metadata.json", 'w') as f:
+        json.dump({'args': vars(args), 'iterations': iterations.tolist()}, f, indent=4)
+
+    # Iterate simulation and record snapshots
+    for i in range(args.iterations):
+        print_iter(i, args.iterations, args.print_freq)
+        saw_wg, saw_rr = iter_sim(args, cfg, saw_wg, saw_rr, i)
+        if i % args.stride == 0:
+            traj_wg[i // args.stride] = saw_wg
+            traj_rr[i // args.stride] = get_saw_rr(cfg, saw_rr)
+
+    traj_wg.flush()
+    traj_rr.flush()
+    print(f"Saved: {dirname}")
+
+def load_trajectory(dirname):
+    """Load a recorded trajectory without reading the snapshots into memory.
+
+    Returns the recording arguments, iteration numbers, position arrays and
+    memory-mapped snapshot arrays (one row per recorded iteration).
+    """
+
+    with open(os.path.join(dirname, "metadata.json")) as f:
+        metadata = json.load(f)
+    traj = {'args': argparse.Namespace(**metadata['args']),
+            'iterations': np.array(metadata['iterations'])}
+    for name in ['x_wg', 'x_rr']:
+        traj[name] = np.load(os.path.join(dirname, f"{name}.npy"))
+    for name in ['saw_wg', 'saw_rr']:
+        traj[name] = np.load(os.path.join(dirname, f"{name}.npy"), mmap_mode='r')
+
+    return traj
+
+def run_replay(args):
+    """Run the replay mode, animating every stride snapshots of a recorded trajectory."""
+
+    if not args.trajectory:
+        raise ValueError("Replay mode requires a recorded trajectory directory (--trajectory)!")
+
+    traj = load_trajectory(args.trajectory)
+
+    # Initialise plot with the configuration the trajectory was recorded with
+    canvas, line_input, line_ring, iter_text = init_anim_plot(traj['args'])
+
+    # Snapshots are only read from disk when drawn
+    def replay_anim(k):
+        iter_text.set_text(f"Iteration: {traj['iterations'][k]}")
+        line_input.set_data(traj['x_wg'], traj['saw_wg'][k])
+        line_ring.set_data(traj['x_rr'], traj['saw_rr'][k])
+        return line_input, line_ring, iter_text
+
+    # Generate and save animation
+    if not args.dry_run:
+        timestamp = datetime.datetime.now().strftime("%m%d-%H%M%S")
+        filename = f"{args.output_dir}replay-{timestamp}.mp4"
+        save_anim(args, canvas, range(0, len(traj['iterations']), args.stride), replay_anim, filename)
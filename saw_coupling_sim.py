@@ -1,31 +1,61 @@
 import argparse
+import importlib
 
-from modules.simulation import init_sim, iter_sim
-from modules.animation import run_anim
-from modules.maximum_amplitude import run_max_amps
+from modules.profiling import start_profile, finish_profile
+
+# Module and function running each mode, only imported once the mode is chosen to keep start-up fast
+MODES = {"animation": ("modules.animation", "run_anim"),
+         "maximum-amplitudes": ("modules.maximum_amplitude", "run_max_amps"),  # --datapoint-density 5000 --step-wg-length 0.2 gives nice figures here
+         "steady-state": ("modules.steady_state", "run_steady_state"),
+         "record": ("modules.trajectory", "run_record"),
+         "replay": ("modules.trajectory", "run_replay"),
+         "grid-sweep": ("modules.grid_sweep", "run_grid_sweep"),
+         "adaptive-sweep": ("modules.adaptive_sweep", "run_adaptive_sweep"),
+         "optimise": ("modules.optimise", "run_optimise"),
+         "spectrum": ("modules.spectrum", "run_spectrum"),
+         "frequency-sweep": ("modules.frequency_sweep", "run_frequency_sweep"),
+         "network": ("modules.network", "run_network")}
+
+def get_parser():
+    """Get the command line argument parser, shared with the benchmark suite."""
 
-if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Simulates coupling of SAWs between an input waveguide and a ring resonator.")
 
     # Simulation modes
-    parser.add_argument("mode", type=str, choices=["animation", "maximum-amplitudes"], help="Mode to run the simulation.")
+    parser.add_argument("mode", type=str, choices=list(MODES), help="Mode to run the simulation.")
 
     # Debugging
     parser.add_argument("--output-dir", type=str, default='outputs/saw_coupling_sim/', help="Path to output directory.")
+    parser.add_argument("--cache-dir", type=str, default='outputs/saw_coupling_sim/cache/', help="Path to cache directory.")
+    parser.add_argument("--cache-size", type=float, default=100, help="Maximum size of cache in MB.")
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write cached results.')
+    parser.add_argument('--profile', nargs='?', const="time", choices=["time", "memory"], help='Time each stage of the run (and track allocations with memory), saving a summary.')
+    parser.add_argument("--checkpoint-dir", type=str, default='outputs/saw_coupling_sim/checkpoints/', help="Path to checkpoint directory.")
+    parser.add_argument("--checkpoint-interval", type=float, default=60, help="Seconds between checkpoints of sweep progress (0 to disable).")
+    parser.add_argument('--checkpoint-state', action='store_true', help='Also checkpoint the SAWs of simulations in progress.')
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted sweep from its last checkpoint.')
     parser.add_argument('--dry-run', action='store_true', help='Initialise simulation but do not run it.')
+    parser.add_argument('--no-plot', action='store_true', help='Only print and save numeric results, without importing Matplotlib.')
     parser.add_argument('--no-rr2wg', action='store_true', help='Disable waveguide to RR SAW coupling.')
     parser.add_argument('--no-loss', action='store_true', help='Disable loss due to SAW coupling.')
 
     # Simulation configuration
     parser.add_argument("--iterations", type=int, default=1000, help="Number of simulation iterations.")
     parser.add_argument("--datapoint-density", type=int, default=100, help="Number of datapoints per unit length.")
+    parser.add_argument("--engine", type=str, default="numpy", choices=["numpy", "numba"], help="Simulation engine for maximum-amplitudes mode.")
+    parser.add_argument("--dtype", type=str, default="float64", choices=["float64", "float32"], help="Floating point precision of the SAWs, source, window and coefficients.")
+    parser.add_argument("--propagation", type=str, default="integer", choices=["integer", "fractional"], help="Move SAWs by whole datapoints or interpolate to keep exact velocities.")
     parser.add_argument("--fps", type=int, default=25, help="Frames per second for animation.")
+    parser.add_argument("--conv-tol", type=float, default=1e-3, help="Relative tolerance on maximum RR amplitude at which to stop iterating (0 to run --iterations).")
+    parser.add_argument("--max-iterations", type=int, default=100000, help="Maximum number of simulation iterations when checking convergence.")
+    parser.add_argument("--progress-log", type=str, help="Path to JSON-lines file to append sweep progress and throughput to.")
     parser.add_argument("--print-freq", type=int, default=10, help="Number of iterations after which counter is updated.")
 
     # Input properties
     parser.add_argument("--wg-length", type=float, default=1, help="Waveguide length.")
     parser.add_argument("--wg-edge-length", type=float, default=1, help="Waveguide edge length.")
     parser.add_argument("--wg-vel", type=float, default=2, help="Waveguide SAW velocity.")
+    parser.add_argument("--frequency", type=float, default=1, help="Input SAW frequency, as SAW wavelengths per unit length.")
     parser.add_argument("--wg2rr-coupl", type=float, default=0.01, help="Coupling coefficient from waveguide to resonator.")
     parser.add_argument("--wg2rr-loss", type=float, default=0.02, help="Loss coefficient from waveguide to resonator.")
     parser.add_argument("--wg-decay-exp", type=float, default=3, help="Resonator decay exponent.")
@@ -41,16 +71,62 @@ if __name__ == "__main__":
     parser.add_argument("--min-wg-length", type=float, default=0, help="Minimum waveguide length.")
     parser.add_argument("--max-wg-length", type=float, default=7.5, help="Maximum waveguide length.")
     parser.add_argument("--step-wg-length", type=float, default=0.1, help="Waveguide length step.")
+    parser.add_argument("--chunk-size", type=int, default=64, help="Number of waveguide lengths simulated at once.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes.")
+
+    # Adaptive-sweep mode
+    parser.add_argument("--coarse-step-wg-length", type=float, default=0.5, help="Waveguide length step of the coarse sweep to refine.")
+    parser.add_argument("--refine-tol", type=float, default=0.01, help="Waveguide length resolution to refine peaks to.")
+    parser.add_argument("--refine-prominence", type=float, default=0.02, help="Prominence of a peak relative to the highest amplitude, below which it is not refined or reported.")
+    parser.add_argument("--refine-grad", type=float, default=0.05, help="Change in normalised amplitude between neighbouring waveguide lengths above which to refine.")
+
+    # Optimise mode
+    parser.add_argument("--optimise", type=str, action='append', metavar="NAME=MIN:MAX", help="Parameter to optimise alongside waveguide length (repeat for more parameters).")
+    parser.add_argument("--opt-tol", type=float, default=1e-3, help="Tolerance on optimum as a fraction of each parameter's range.")
+    parser.add_argument("--max-evals", type=int, default=200, help="Maximum number of simulations when optimising.")
+    parser.add_argument("--opt-seeds", type=int, default=8, help="Number of evenly spaced coupling lengths simulated together to start the optimiser from.")
+
+    # Grid-sweep mode
+    parser.add_argument("--grid", type=str, action='append', metavar="NAME=MIN:MAX:STEP", help="Parameter to sweep alongside waveguide length, as a range or comma-separated values (repeat for more axes).")
+
+    # Frequency-sweep mode
+    parser.add_argument("--min-frequency", type=float, default=0.5, help="Minimum input SAW frequency.")
+    parser.add_argument("--max-frequency", type=float, default=1.5, help="Maximum input SAW frequency.")
+    parser.add_argument("--step-frequency", type=float, default=0.005, help="Input SAW frequency step.")
+
+    # Spectrum mode
+    parser.add_argument("--pulse-width", type=float, default=0.1, help="Standard deviation of the Gaussian input pulse in SAW wavelengths.")
+    parser.add_argument("--spectrum-iterations", type=int, default=20000, help="Number of iterations of the impulse response, setting the frequency resolution.")
 
-    args = parser.parse_args()
+    # Network mode
+    parser.add_argument("--network", type=str, help="Path to JSON description of the waveguides, rings and coupling regions to simulate.")
+
+    # Record and replay modes
+    parser.add_argument("--stride", type=int, default=1, help="Number of iterations between recorded snapshots, or snapshots between replayed frames.")
+    parser.add_argument("--trajectory", type=str, help="Path to recorded trajectory directory to replay.")
+
+    return parser
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
 
     # Check that datapoint-density is even as it is halved in simulation logic
     if args.datapoint_density % 2 != 0:
         raise ValueError("Datapoint density must be an even integer.")
 
+    # Animations are the only output of their modes
+    if args.no_plot and args.mode in ["animation", "replay"]:
+        raise ValueError(f"Cannot run {args.mode} mode with --no-plot!")
+
+    # Only the main process is profiled
+    if args.profile:
+        if args.workers > 1:
+            print("WARNING - Profiling does not include worker processes")
+        start_profile(args)
+
     # Run simulation in appropriate mode
-    if args.mode == "animation":
-        run_anim(args)
-    if args.mode == "maximum-amplitudes":
-        # --datapoint-density 5000 --step-wg-length 0.2 gives nice figures here
-        run_max_amps(args)
+    module_name, func_name = MODES[args.mode]
+    getattr(importlib.import_module(module_name), func_name)(args)
+
+    if args.profile:
+        finish_profile(args)
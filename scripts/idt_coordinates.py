@@ -1,64 +1,38 @@
 import numpy as np
 import matplotlib.pyplot as plt
-
-x = np.arange(0, 10.000001, 0.000001)
-C = 0.875 / 0.32
-D = (1.125/0.32 - 0.875/0.32) / 20
-y = np.sin(2 * np.pi * (C + D * x) * x)
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--start-freq", type=float, default=0.875)
+parser.add_argument("--end-freq", type=float, default=1.125)
+parser.add_argument("--velocity", type=float, default=0.32)
+parser.add_argument("--length", type=float, default=10)
+args = parser.parse_args()
+
+# Linear chirp from start to end frequency along the IDT, sin(2 * pi * (C + D * x) * x)
+C = args.start_freq / args.velocity
+D = (args.end_freq/args.velocity - args.start_freq/args.velocity) / (2 * args.length)
 pos_sol = 1 / np.sqrt(2)
 neg_sol = - pos_sol
 
-last_val = 0
-idt_pos_coordinates = []
-idt_neg_coordinates = []
-
-# for i in range(len(y)):
-#     if (np.abs(y[i]-pos_sol) < 0.000008) and (np.abs(last_val-x[i]) > 0.001):
-#         print(f"{round(100*x[i], 10)},30 {round(100*x[i], 10)},190")
-#         last_val = x[i]
-# print()
-
-# for i in range(len(y)):
-#     if (np.abs(y[i]-pos_sol) < 0.000008) and (np.abs(last_val-x[i]) > 0.001):
-#         print(f"{round(100*x[i], 10)},30")
-#         last_val = x[i]
-# print()
-
-# for i in range(len(y)):
-#     if (np.abs(y[i]-pos_sol) < 0.000008) and (np.abs(last_val-x[i]) > 0.001):
-#         print(f"{round(100*x[i], 10)},190")
-#         last_val = x[i]
-# print()
-
-# for i in range(len(y)):
-#     if (np.abs(y[i]-neg_sol) < 0.000008) and (np.abs(last_val-x[i]) > 0.001):
-#         print(f"{round(100*x[i], 10)},10 {round(100*x[i], 10)},170")
-#         last_val = x[i]
-# print()
-
-# for i in range(len(y)):
-#     if (np.abs(y[i]-neg_sol) < 0.000008) and (np.abs(last_val-x[i]) > 0.001):
-#         print(f"{round(100*x[i], 10)},10")
-#         last_val = x[i]
-# print()
-
-# for i in range(len(y)):
-#     if (np.abs(y[i]-neg_sol) < 0.000008) and (np.abs(last_val-x[i]) > 0.001):
-#         print(f"{round(100*x[i], 10)},170")
-#         last_val = x[i]
-# print()
+# sin crosses +-1/sqrt(2) where the phase (C + D * x) * x is k + 1/8, k + 3/8 (positive) or k + 5/8, k + 7/8 (negative)
+phase_max = (C + D * args.length) * args.length
+periods = np.arange(np.floor(phase_max) + 1)
+pos_phases = np.sort(np.concatenate((periods + 1/8, periods + 3/8)))
+neg_phases = np.sort(np.concatenate((periods + 5/8, periods + 7/8)))
 
-for i in range(len(y)):
-    if (np.abs(y[i]-pos_sol) < 0.000008) and (np.abs(last_val-x[i]) > 0.001):
-        idt_pos_coordinates.append(x[i])
-        last_val = x[i]
+# Positive root of D * x^2 + C * x - phase = 0, in a form that is also stable for D = 0
+idt_pos_coordinates = 2 * pos_phases / (C + np.sqrt(C**2 + 4 * D * pos_phases))
+idt_neg_coordinates = 2 * neg_phases / (C + np.sqrt(C**2 + 4 * D * neg_phases))
+idt_pos_coordinates = idt_pos_coordinates[idt_pos_coordinates <= args.length]
+idt_neg_coordinates = idt_neg_coordinates[idt_neg_coordinates <= args.length]
 
-for i in range(len(y)):
-    if (np.abs(y[i]-neg_sol) < 0.000008) and (np.abs(last_val-x[i]) > 0.001):
-        idt_neg_coordinates.append(x[i])
-        last_val = x[i]
+# print(' '.join(f"{round(100*x, 10)},30 {round(100*x, 10)},190" for x in idt_pos_coordinates))
+# print(' '.join(f"{round(100*x, 10)},10 {round(100*x, 10)},170" for x in idt_neg_coordinates))
+np.savetxt("idt_pos_coordinates.csv", idt_pos_coordinates, fmt='%.10g')
+np.savetxt("idt_neg_coordinates.csv", idt_neg_coordinates, fmt='%.10g')
 
-x_reduced = np.arange(0, 10.001, 0.001)
+x_reduced = np.arange(0, args.length + 0.001, 0.001)
 y_reduced = np.sin(2 * np.pi * (C + D * x_reduced) * x_reduced)
 
 y_max = 1.05
@@ -77,7 +51,7 @@ for i in range(int(len(idt_neg_coordinates)/2)):
 plt.title('')
 plt.xlabel('')
 plt.ylabel('')
-plt.xlim(0, 1000)
+plt.xlim(0, 100*args.length)
 plt.ylim(y_min, y_max)
 # plt.legend()
 # plt.grid(True)